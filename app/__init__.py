@@ -1,22 +1,84 @@
 import os
+import threading
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from .config import carregar_perfil
+from .models import db
 
-app = Flask(__name__)
+# Importar o pacote não conecta ao banco nem carrega pandas/openpyxl/Pillow:
+# o app é montado por criar_app() e o banco é preparado por
+# 'flask inicializar-banco' (ou, em desenvolvimento, na primeira requisição).
+#
+#     gunicorn 'app:criar_app()'
+#     flask --app 'app:criar_app()' inicializar-banco
 
-app.config['SECRET_KEY'] = 'chave_super_secreta_do_museu'
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'postgresql://usuario:senha@db:5432/fichas_db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-from .models import db
-db.init_app(app)
+def criar_app(perfil=None):
+    app = Flask(__name__)
+
+    app.config.from_object(carregar_perfil(perfil))
+    if not app.config['TAREFAS_PASTA']:
+        app.config['TAREFAS_PASTA'] = os.path.join(app.instance_path, 'tarefas')
+    if not app.config['UPLOADS_QUARENTENA_PASTA']:
+        app.config['UPLOADS_QUARENTENA_PASTA'] = os.path.join(app.instance_path, 'quarentena')
+
+    db.init_app(app)
+
+    from .cache import paginas
+    paginas.init_app(app)
+
+    from . import instrumentacao
+    instrumentacao.instalar(app)
+
+    from .imagens import RENDICOES_FOLDER
+    os.makedirs(RENDICOES_FOLDER, exist_ok=True)
 
-with app.app_context():
-    from .models import Ficha 
+    from . import routes, comandos
+    routes.registrar(app)
+    comandos.registrar(app)
+
+    if app.config['INICIALIZAR_BANCO_AO_INICIAR']:
+        _inicializar_na_primeira_requisicao(app)
+    return app
+
+
+def inicializar_banco():
+    from .models import Ficha, Estatistica, criar_indices, sincronizar_colunas
     db.create_all()
+    sincronizar_colunas()
+    criar_indices()
+    try:
+        from .busca import instalar_busca
+        instalar_busca()
+    except Exception as e:
+        print(f"Busca textual indisponível: {e}")
+    from .sincronizacao import preencher_sequencia
+    preencher_sequencia()
+    from .migracoes import modo_no_banco
+    from .vocabulario import MODO
+    gravado = modo_no_banco()
+    if gravado and gravado != MODO:
+        print(f"ATENÇÃO: as marcações no banco estão no modo {gravado}, mas MARCACOES_ARMAZENAMENTO={MODO}. "
+              f"Rode: flask migrar-marcacoes --para {MODO}")
+    if not Estatistica.query.first() and Ficha.query.first():
+        from .estatisticas import reconstruir
+        reconstruir()
     print("Banco de dados conectado e tabelas verificadas.")
 
-from .routes import *
+
+def _inicializar_na_primeira_requisicao(app):
+    # se o banco ainda não estiver no ar, a requisição falha e a próxima tenta de novo
+    pronto = threading.Event()
+    trava = threading.Lock()
+
+    @app.before_request
+    def _preparar_banco():
+        if pronto.is_set():
+            return
+        with trava:
+            if not pronto.is_set():
+                inicializar_banco()
+                pronto.set()
+
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    criar_app().run(host='0.0.0.0', port=5000, debug=True)
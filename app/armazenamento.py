@@ -0,0 +1,188 @@
+import heapq
+import os
+import posixpath
+import shutil
+import time
+from datetime import datetime
+from sqlalchemy import select
+from .models import db, Ficha, Imagem
+from .imagens import STATIC_FOLDER, UPLOAD_FOLDER, RENDICOES_FOLDER, caminho_absoluto, chave_rendicao
+
+ACOES = ('relatorio', 'quarentena', 'excluir')
+TAMANHO_LOTE_VERIFICACAO = 5000
+# quantos itens de cada lista vão no relatório (os totais são sempre completos)
+LIMITE_AMOSTRA = 50
+MAIORES_FICHAS = 20
+
+
+def _normalizar(caminho):
+    # caminhos de 'imagens' são relativos a app/static; os importados de
+    # planilhas antigas podem vir com barras invertidas ou './'
+    return posixpath.normpath(caminho.replace('\\', '/'))
+
+
+def _varrer(pasta, prefixo):
+    """{caminho relativo a app/static: [bytes, mtime, referenciado]} dos arquivos da pasta (sem subpastas)."""
+    arquivos = {}
+    if not os.path.isdir(pasta):
+        return arquivos
+    with os.scandir(pasta) as entradas:
+        for entrada in entradas:
+            if entrada.is_file(follow_symlinks=False):
+                info = entrada.stat(follow_symlinks=False)
+                arquivos[f"{prefixo}/{entrada.name}"] = [info.st_size, info.st_mtime, False]
+    return arquivos
+
+
+def _em_uso(caminhos):
+    em_uso = set()
+    for inicio in range(0, len(caminhos), TAMANHO_LOTE_VERIFICACAO):
+        em_uso.update(c for (c,) in db.session.query(Imagem.caminho).distinct()
+                      .filter(Imagem.caminho.in_(caminhos[inicio:inicio + TAMANHO_LOTE_VERIFICACAO])))
+    return em_uso
+
+
+def _destino_quarentena(pasta_quarentena, caminho):
+    destino = os.path.join(pasta_quarentena, *caminho.split('/'))
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    return destino
+
+
+def _tratar_orfaos(orfaos, rendicoes_orfas, acao, idade_minima, pasta_quarentena):
+    # confere de novo, logo antes de mexer no disco: o arquivo pode ter sido
+    # referenciado (ou reaproveitado por um upload igual) depois da varredura
+    em_uso = _em_uso(orfaos)
+    limite = time.time() - idade_minima
+    tratados = 0
+    for caminho in orfaos + rendicoes_orfas:
+        if caminho in em_uso:
+            continue
+        origem = caminho_absoluto(caminho)
+        try:
+            if os.stat(origem).st_mtime > limite:
+                continue
+            if acao == 'quarentena':
+                shutil.move(origem, _destino_quarentena(pasta_quarentena, caminho))
+            else:
+                os.remove(origem)
+            tratados += 1
+        except FileNotFoundError:
+            pass
+    return tratados
+
+
+def verificar(acao='relatorio', idade_minima=3600, pasta_quarentena=None):
+    """Compara app/static/uploads com a tabela 'imagens'.
+
+    Lista arquivos órfãos (sem linha em 'imagens'), referências quebradas
+    (linha sem arquivo) e o espaço ocupado por ficha e por seção. Com
+    acao='quarentena' ou 'excluir', os órfãos mais velhos que idade_minima
+    segundos são movidos para pasta_quarentena ou apagados.
+    """
+    if acao not in ACOES:
+        raise ValueError(f"ação inválida: {acao}")
+    if acao == 'quarentena' and not pasta_quarentena:
+        raise ValueError("informe a pasta de quarentena")
+
+    prefixo_uploads = os.path.relpath(UPLOAD_FOLDER, STATIC_FOLDER).replace(os.sep, '/')
+    prefixo_rendicoes = os.path.relpath(RENDICOES_FOLDER, STATIC_FOLDER).replace(os.sep, '/')
+    arquivos = _varrer(UPLOAD_FOLDER, prefixo_uploads)
+    rendicoes = _varrer(RENDICOES_FOLDER, prefixo_rendicoes)
+
+    # uma única consulta, em streaming, marca os arquivos referenciados e soma
+    # os bytes por ficha e por seção
+    chaves_rendicao = set()
+    quebradas = []
+    total_quebradas = 0
+    fora_de_uploads = 0
+    por_ficha = {}
+    por_secao = {}
+    linhas = db.session.execute(
+        select(Imagem.caminho, Imagem.hash, Imagem.ficha_id, Ficha.numero_ficha, Ficha.secao_guarda)
+        .join(Ficha, Imagem.ficha_id == Ficha.id)
+        .execution_options(yield_per=TAMANHO_LOTE_VERIFICACAO))
+    for linha in linhas:
+        chaves_rendicao.add(chave_rendicao(linha))
+        caminho = _normalizar(linha.caminho)
+        arquivo = arquivos.get(caminho)
+        if arquivo is not None:
+            arquivo[2] = True
+            tamanho = arquivo[0]
+        elif os.path.isfile(caminho_absoluto(caminho)):
+            # caminho antigo fora de uploads/: existe, mas não é gerenciado aqui
+            fora_de_uploads += 1
+            tamanho = os.path.getsize(caminho_absoluto(caminho))
+        else:
+            total_quebradas += 1
+            if len(quebradas) < LIMITE_AMOSTRA:
+                quebradas.append({'ficha_id': linha.ficha_id, 'numero_ficha': linha.numero_ficha,
+                                  'caminho': linha.caminho})
+            continue
+
+        ficha = por_ficha.setdefault(linha.ficha_id, [linha.numero_ficha, 0, 0])
+        ficha[1] += tamanho
+        ficha[2] += 1
+        secao = por_secao.setdefault((linha.secao_guarda or '').strip(), [set(), 0, 0])
+        secao[0].add(linha.ficha_id)
+        secao[1] += tamanho
+        secao[2] += 1
+
+    limite = time.time() - idade_minima
+    orfaos, recentes = [], 0
+    bytes_orfaos = 0
+    for caminho, (tamanho, mtime, referenciado) in arquivos.items():
+        if referenciado:
+            continue
+        if mtime > limite:
+            recentes += 1
+            continue
+        orfaos.append(caminho)
+        bytes_orfaos += tamanho
+    rendicoes_orfas, bytes_rendicoes_orfas = [], 0
+    for caminho, (tamanho, mtime, _) in rendicoes.items():
+        chave = posixpath.basename(caminho).rsplit('_', 1)[0]
+        if chave not in chaves_rendicao and mtime <= limite:
+            rendicoes_orfas.append(caminho)
+            bytes_rendicoes_orfas += tamanho
+
+    relatorio = {
+        'acao': acao,
+        'verificado_em': datetime.now().isoformat(timespec='seconds'),
+        'arquivos': len(arquivos),
+        'bytes': sum(a[0] for a in arquivos.values()),
+        'referenciados': {
+            'arquivos': sum(1 for a in arquivos.values() if a[2]),
+            'bytes': sum(a[0] for a in arquivos.values() if a[2]),
+            'fora_de_uploads': fora_de_uploads,
+        },
+        'orfaos': {
+            'arquivos': len(orfaos),
+            'bytes': bytes_orfaos,
+            'recentes_ignorados': recentes,
+            'amostra': sorted(orfaos)[:LIMITE_AMOSTRA],
+        },
+        'rendicoes': {
+            'arquivos': len(rendicoes),
+            'bytes': sum(a[0] for a in rendicoes.values()),
+            'orfas': len(rendicoes_orfas),
+            'bytes_orfas': bytes_rendicoes_orfas,
+        },
+        'referencias_quebradas': {'total': total_quebradas, 'amostra': quebradas},
+        'por_secao': {secao or '(sem seção)': {'fichas': len(ids), 'arquivos': arquivos_secao, 'bytes': tamanho}
+                      for secao, (ids, tamanho, arquivos_secao) in sorted(por_secao.items())},
+        'maiores_fichas': [
+            {'ficha_id': ficha_id, 'numero_ficha': numero, 'bytes': tamanho, 'arquivos': arquivos_ficha}
+            for ficha_id, (numero, tamanho, arquivos_ficha)
+            in heapq.nlargest(MAIORES_FICHAS, por_ficha.items(), key=lambda item: item[1][1])
+        ],
+    }
+    # encerra a transação de leitura antes de mexer nos arquivos
+    db.session.rollback()
+
+    if acao != 'relatorio':
+        pasta = None
+        if acao == 'quarentena':
+            pasta = os.path.join(pasta_quarentena, datetime.now().strftime('%Y%m%d_%H%M%S'))
+            relatorio['pasta_quarentena'] = pasta
+        relatorio['tratados'] = _tratar_orfaos(orfaos, rendicoes_orfas, acao, idade_minima, pasta)
+    return relatorio
@@ -0,0 +1,98 @@
+from sqlalchemy import func, literal_column, or_, text
+from .models import db, Ficha
+from .consultas import COLUNAS_LISTAGEM, POR_PAGINA_PADRAO, POR_PAGINA_MAXIMO
+
+CONFIGURACAO = 'portuguese'
+
+# A coluna 'busca' é gerada pelo PostgreSQL (tsvector com pesos por campo) e
+# não faz parte do modelo, para que o restante do app continue portável.
+# unaccent() não é IMMUTABLE, por isso o wrapper f_unaccent.
+DDL_BUSCA = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+    $$ SELECT public.unaccent('public.unaccent', $1) $$
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    """,
+    f"""
+    ALTER TABLE fichas ADD COLUMN IF NOT EXISTS busca tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{CONFIGURACAO}', f_unaccent(coalesce(titulo, ''))), 'A') ||
+        setweight(to_tsvector('{CONFIGURACAO}', f_unaccent(coalesce(autor, ''))), 'A') ||
+        setweight(to_tsvector('simple', coalesce(registro, '') || ' ' || coalesce(n_chamada, '')), 'B') ||
+        setweight(to_tsvector('{CONFIGURACAO}', f_unaccent(coalesce(observacoes, ''))), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_fichas_busca ON fichas USING gin (busca)",
+    # trigramas: trechos de número de chamada/registro ("823.1", "B12-") que
+    # o tsvector não quebra em tokens úteis
+    "CREATE INDEX IF NOT EXISTS ix_fichas_n_chamada_trgm ON fichas USING gin (n_chamada gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_fichas_registro_trgm ON fichas USING gin (registro gin_trgm_ops)",
+]
+
+
+# engine -> se a coluna 'busca' existe; a instalação pode falhar (papel sem
+# permissão para CREATE EXTENSION, por exemplo) e o app segue sem ela
+_instalada = {}
+
+
+def _postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def busca_disponivel():
+    if not _postgres():
+        return False
+    engine = db.engine
+    if engine not in _instalada:
+        colunas = db.inspect(engine).get_columns('fichas')
+        _instalada[engine] = any(coluna['name'] == 'busca' for coluna in colunas)
+    return _instalada[engine]
+
+
+def instalar_busca():
+    if not _postgres():
+        return False
+    _instalada.pop(db.engine, None)
+    with db.engine.begin() as conn:
+        for comando in DDL_BUSCA:
+            conn.execute(text(comando))
+    _instalada[db.engine] = True
+    return True
+
+
+def _consulta_postgres(termo):
+    consulta = func.websearch_to_tsquery(CONFIGURACAO, func.f_unaccent(termo))
+    busca = literal_column('fichas.busca')
+    parcial = f"%{termo}%"
+    rank = (func.ts_rank_cd(busca, consulta)
+            + func.similarity(func.coalesce(Ficha.n_chamada, ''), termo))
+    return (db.session.query(*COLUNAS_LISTAGEM, rank.label('rank'))
+            .filter(or_(busca.op('@@')(consulta),
+                        Ficha.n_chamada.ilike(parcial),
+                        Ficha.registro.ilike(parcial)))
+            .order_by(rank.desc(), Ficha.id.desc()))
+
+
+def _consulta_simples(termo):
+    # fallback sem índice (SQLite / bancos sem a coluna 'busca')
+    parcial = f"%{termo}%"
+    campos = [Ficha.titulo, Ficha.autor, Ficha.observacoes, Ficha.registro, Ficha.n_chamada]
+    return (db.session.query(*COLUNAS_LISTAGEM)
+            .filter(or_(*[c.ilike(parcial) for c in campos]))
+            .order_by(Ficha.id.desc()))
+
+
+def buscar(termo, pagina=1, por_pagina=POR_PAGINA_PADRAO):
+    termo = (termo or '').strip()
+    if not termo:
+        return [], False
+    por_pagina = max(1, min(por_pagina, POR_PAGINA_MAXIMO))
+    pagina = max(1, pagina)
+
+    query = _consulta_postgres(termo) if busca_disponivel() else _consulta_simples(termo)
+    # resultados ranqueados: OFFSET é aceitável porque a ordem é por relevância
+    # e quase ninguém passa das primeiras páginas
+    linhas = query.offset((pagina - 1) * por_pagina).limit(por_pagina + 1).all()
+    tem_proxima = len(linhas) > por_pagina
+    return linhas[:por_pagina], tem_proxima
@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """Cache em memória do processo, com despejo por tamanho total em bytes."""
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self.bytes = 0
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.despejos = 0
+
+    def obter(self, chave):
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is None:
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return valor
+
+    def guardar(self, chave, valor):
+        tamanho = len(valor)
+        if tamanho > self.limite_bytes:
+            return
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self.bytes -= len(anterior)
+            self._itens[chave] = valor
+            self.bytes += tamanho
+            while self.bytes > self.limite_bytes:
+                _, removido = self._itens.popitem(last=False)
+                self.bytes -= len(removido)
+                self.despejos += 1
+
+    def remover_prefixo(self, prefixo):
+        with self._lock:
+            for chave in [c for c in self._itens if c.startswith(prefixo)]:
+                self.bytes -= len(self._itens.pop(chave))
+
+    def metricas(self):
+        return {'acertos': self.acertos, 'falhas': self.falhas, 'despejos': self.despejos,
+                'itens': len(self._itens), 'bytes': self.bytes, 'limite_bytes': self.limite_bytes}
+
+
+class BackendLocal:
+    """Substituto local do backend compartilhado (mesma interface do Redis)."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._itens = {}
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or item[1] < time.monotonic():
+                self._itens.pop(chave, None)
+                return None
+            return item[0]
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = (valor, time.monotonic() + self.ttl)
+
+    def delete_prefix(self, prefixo):
+        with self._lock:
+            for chave in [c for c in self._itens if c.startswith(prefixo)]:
+                del self._itens[chave]
+
+
+class BackendRedis:
+    def __init__(self, url, ttl):
+        import redis
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, chave):
+        return self._redis.get(chave)
+
+    def set(self, chave, valor):
+        self._redis.set(chave, valor, ex=self.ttl)
+
+    def delete_prefix(self, prefixo):
+        for chave in self._redis.scan_iter(match=f"{prefixo}*"):
+            self._redis.delete(chave)
+
+
+def _criar_backend(config):
+    destino = config.get('CACHE_COMPARTILHADO')
+    ttl = config['CACHE_TTL']
+    if not destino:
+        return None
+    if destino == 'local':
+        return BackendLocal(ttl)
+    return BackendRedis(destino, ttl)
+
+
+class CachePaginas:
+    """Duas camadas: LRU do processo e, opcionalmente, um backend compartilhado."""
+
+    def __init__(self, local=None, compartilhado=None):
+        self.local = local
+        self.compartilhado = compartilhado
+        self.acertos_compartilhado = 0
+
+    def init_app(self, app):
+        self.local = CacheLRU(app.config['CACHE_LIMITE_BYTES'])
+        self.compartilhado = _criar_backend(app.config)
+
+    def obter(self, chave):
+        valor = self.local.obter(chave)
+        if valor is None and self.compartilhado is not None:
+            valor = self.compartilhado.get(chave)
+            if valor is not None:
+                self.acertos_compartilhado += 1
+                self.local.guardar(chave, valor)
+        return valor
+
+    def guardar(self, chave, valor):
+        self.local.guardar(chave, valor)
+        if self.compartilhado is not None:
+            self.compartilhado.set(chave, valor)
+
+    def invalidar(self, prefixo):
+        self.local.remover_prefixo(prefixo)
+        if self.compartilhado is not None:
+            self.compartilhado.delete_prefix(prefixo)
+
+    def metricas(self):
+        metricas = self.local.metricas()
+        metricas['acertos_compartilhado'] = self.acertos_compartilhado
+        metricas['compartilhado'] = type(self.compartilhado).__name__ if self.compartilhado else None
+        return metricas
+
+
+# configurado por criar_app() (init_app), como o db
+paginas = CachePaginas()
+
+
+def chave_ficha(id, versao):
+    return f"ficha:{id}:{versao}"
+
+
+def invalidar_ficha(id):
+    # a chave já inclui a versão, então páginas antigas nunca são servidas;
+    # invalidar só libera o espaço ocupado por elas
+    paginas.invalidar(f"ficha:{id}:")
@@ -0,0 +1,178 @@
+from datetime import datetime
+from sqlalchemy import false, select, update
+from sqlalchemy.exc import IntegrityError
+from .models import db, Ficha, Imagem, insert_dialeto, reservar_sequencia
+from .consultas import ler_inteiro
+from .estatisticas import COLUNAS_ESTATISTICA, registrar_alteracao
+from .imagens import gravar_arquivos
+from .vocabulario import opcoes_formulario, separar_outros
+
+CAMPOS_TEXTO = ['autor', 'titulo', 'registro', 'n_chamada', 'secao_guarda', 'data_obra',
+                'paginas', 'dimensoes', 'observacoes', 'tecnico_nome']
+
+# campo da ficha -> (prefixo dos checkboxes no formulário, opções)
+OPCOES_FORMULARIO = opcoes_formulario()
+
+
+def processar_grupo_checkbox(prefixo, lista_opcoes, form_data):
+    resultado = {}
+    for opcao in lista_opcoes:
+        chave_html = f"{prefixo}_{opcao}"
+        resultado[opcao] = True if form_data.get(chave_html) else False
+
+    campo_outro = form_data.get(f"{prefixo}_outro")
+    if campo_outro:
+        resultado['outro_texto'] = campo_outro
+    return resultado
+
+
+class ConflitoVersao(Exception):
+    """A ficha mudou desde que o formulário foi aberto (ou o número já existe)."""
+
+    def __init__(self, ficha_id, versao_atual, versao_esperada):
+        super().__init__(f"ficha {ficha_id}: versão atual {versao_atual}, esperada {versao_esperada}")
+        self.ficha_id = ficha_id
+        self.versao_atual = versao_atual
+        self.versao_esperada = versao_esperada
+
+
+def ler_formulario(form):
+    numero = (form.get('numero_ficha') or '').strip()
+    if not numero:
+        # NULL não dispara o ON CONFLICT: cada gravação criaria uma ficha nova
+        raise ValueError("Informe o número da ficha.")
+    valores = {'numero_ficha': numero}
+    valores.update({campo: form.get(campo) for campo in CAMPOS_TEXTO})
+    valores['avaliacao'] = ler_inteiro(form.get('avaliacao'))
+
+    data_str = form.get('data_preenchimento')
+    if data_str:
+        valores['data_preenchimento'] = datetime.strptime(data_str, '%Y-%m-%d').date()
+    else:
+        valores['data_preenchimento'] = datetime.now().date()
+
+    for campo, (prefixo, opcoes) in OPCOES_FORMULARIO.items():
+        valores[campo] = processar_grupo_checkbox(prefixo, opcoes, form)
+    return separar_outros(valores)
+
+
+def _conflito(condicao, versao_esperada):
+    atual = db.session.execute(select(Ficha.id, Ficha.versao).where(condicao)).first()
+    db.session.rollback()
+    if atual is None:
+        # a ficha foi excluída entre a leitura e a gravação
+        return ConflitoVersao(None, None, versao_esperada)
+    return ConflitoVersao(atual.id, atual.versao, versao_esperada)
+
+
+def _atualizar_por_id(ficha_id, valores, versao_esperada, arquivos):
+    # formulário de edição: a ficha é a do id, mesmo que o número tenha mudado
+    colunas = [getattr(Ficha, c) for c in COLUNAS_ESTATISTICA]
+    atual = db.session.execute(select(Ficha.id, Ficha.versao, *colunas).where(Ficha.id == ficha_id)).first()
+    if atual is None or atual.versao != versao_esperada:
+        db.session.rollback()
+        raise ConflitoVersao(atual and atual.id, atual and atual.versao, versao_esperada)
+    outra = db.session.execute(select(Ficha.id).where(Ficha.numero_ficha == valores['numero_ficha'],
+                                                      Ficha.id != ficha_id)).first()
+    if outra is not None:
+        db.session.rollback()
+        raise ValueError(f"Já existe outra ficha com o número {valores['numero_ficha']}.")
+    antes = {c: getattr(atual, c) for c in COLUNAS_ESTATISTICA}
+
+    try:
+        # contador antes da linha da ficha, como nas demais gravações
+        seq = reservar_sequencia(db.session.connection())
+        gravada = db.session.execute(
+            update(Ficha).where(Ficha.id == ficha_id, Ficha.versao == versao_esperada)
+            .values(**valores, versao=Ficha.versao + 1, seq_alteracao=seq, atualizado_em=datetime.now())
+            .returning(Ficha.id, Ficha.versao)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if gravada is None:
+            raise _conflito(Ficha.id == ficha_id, versao_esperada)
+        ids_imagens = _gravar_imagens(gravada.id, arquivos, True)
+        registrar_alteracao(antes, valores)
+        db.session.commit()
+        return gravada.id, gravada.versao, ids_imagens
+    except IntegrityError:
+        # número gravado por outra requisição depois da conferência acima
+        db.session.rollback()
+        raise ValueError(f"Já existe outra ficha com o número {valores['numero_ficha']}.")
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _gravar_imagens(ficha_id, arquivos, existente):
+    if not arquivos:
+        return []
+    repetidos = set()
+    if existente:
+        repetidos = {h for (h,) in db.session.query(Imagem.hash).filter(
+            Imagem.ficha_id == ficha_id, Imagem.hash.in_([a['hash'] for a in arquivos]))}
+    linhas = [dict(a, ficha_id=ficha_id) for a in arquivos if a['hash'] not in repetidos]
+    if not linhas:
+        return []
+    return list(db.session.execute(insert_dialeto(Imagem).values(linhas).returning(Imagem.id)).scalars())
+
+
+def salvar_ficha(form, fotos):
+    """Cria ou atualiza a ficha do formulário numa única transação.
+
+    O formulário de edição envia 'id' e 'versao': a ficha desse id só é
+    atualizada se ainda estiver nessa versão (controle otimista de
+    concorrência), e o número pode mudar desde que não seja de outra ficha.
+    Sem 'id', a ficha é a do número: sem 'versao' o formulário só pode
+    criar (número existente é recusado); com 'versao', vale a mesma
+    conferência. Número vazio levanta ValueError.
+    Devolve (id da ficha, nova versão, ids das imagens novas).
+    """
+    valores = ler_formulario(form)
+    numero = valores['numero_ficha']
+    versao_esperada = ler_inteiro(form.get('versao'))
+    ficha_id = ler_inteiro(form.get('id'))
+    if ficha_id is not None and versao_esperada is None:
+        raise ValueError("Formulário de edição sem a versão da ficha.")
+    # os arquivos vão para o disco antes da transação: o nome é o hash do
+    # conteúdo, então uma gravação que falhe só deixa um arquivo reaproveitável
+    arquivos = gravar_arquivos(fotos)
+    if ficha_id is not None:
+        return _atualizar_por_id(ficha_id, valores, versao_esperada, arquivos)
+
+    antes = None
+    if versao_esperada is not None:
+        colunas = [getattr(Ficha, c) for c in COLUNAS_ESTATISTICA]
+        atual = db.session.execute(select(Ficha.id, Ficha.versao, *colunas)
+                                   .where(Ficha.numero_ficha == numero)).first()
+        if atual is not None:
+            if atual.versao != versao_esperada:
+                db.session.rollback()
+                raise ConflitoVersao(atual.id, atual.versao, versao_esperada)
+            # a versão confere: estes são exatamente os valores que serão
+            # substituídos (toda gravação incrementa a versão)
+            antes = {c: getattr(atual, c) for c in COLUNAS_ESTATISTICA}
+
+    try:
+        agora = datetime.now()
+        seq = reservar_sequencia(db.session.connection())
+        stmt = insert_dialeto(Ficha).values(**valores, versao=1, seq_alteracao=seq,
+                                            criado_em=agora, atualizado_em=agora)
+        atualizacao = {campo: stmt.excluded[campo] for campo in valores if campo != 'numero_ficha'}
+        atualizacao.update(versao=Ficha.versao + 1, seq_alteracao=seq, atualizado_em=agora)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['numero_ficha'],
+            set_=atualizacao,
+            # sem versão conferida, um número existente nunca é sobrescrito
+            where=(Ficha.versao == versao_esperada) if antes is not None else false(),
+        ).returning(Ficha.id, Ficha.versao)
+        gravada = db.session.execute(stmt).first()
+        if gravada is None:
+            raise _conflito(Ficha.numero_ficha == numero, versao_esperada)
+
+        ids_imagens = _gravar_imagens(gravada.id, arquivos, antes is not None)
+        registrar_alteracao(antes, valores)
+        db.session.commit()
+        return gravada.id, gravada.versao, ids_imagens
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,140 @@
+import json
+import os
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from app import inicializar_banco
+from .models import db, criar_indices
+from . import armazenamento, estatisticas, tarefas
+from .migracoes import converter_marcacoes
+from .vocabulario import MODOS
+
+
+def _sem_tempo_limite(conexao_dbapi, registro):
+    # autocommit só durante o SET: sem ele o psycopg2 abriria uma transação aqui
+    autocommit = conexao_dbapi.autocommit
+    conexao_dbapi.autocommit = True
+    cursor = conexao_dbapi.cursor()
+    cursor.execute("SET statement_timeout = 0")
+    cursor.close()
+    conexao_dbapi.autocommit = autocommit
+
+
+def liberar_tempo_limite():
+    """Tira o DB_STATEMENT_TIMEOUT_MS das conexões deste processo.
+
+    O limite protege as requisições web; os comandos de manutenção
+    reescrevem ou percorrem a tabela inteira e seriam cancelados no meio.
+    Precisa ser chamada antes da primeira conexão do comando.
+    """
+    if db.engine.dialect.name == 'postgresql' and not event.contains(db.engine, 'connect', _sem_tempo_limite):
+        event.listen(db.engine, 'connect', _sem_tempo_limite)
+
+
+@click.command('criar-indices')
+@with_appcontext
+def criar_indices_comando():
+    liberar_tempo_limite()
+    criar_indices()
+    print("Índices verificados.")
+
+
+@click.command('reconstruir-estatisticas')
+@with_appcontext
+def reconstruir_estatisticas_comando():
+    liberar_tempo_limite()
+    total = estatisticas.reconstruir()
+    print(f"Estatísticas reconstruídas: {total} contadores.")
+
+
+@click.command('executar-tarefas')
+@with_appcontext
+@click.option('--intervalo', default=2.0, help='Segundos entre consultas à fila vazia.')
+@click.option('--uma-vez', is_flag=True, help='Sai quando a fila esvaziar.')
+def executar_tarefas_comando(intervalo, uma_vez):
+    if 'IMPORTACAO_PROCESSOS' not in os.environ:
+        current_app.config['IMPORTACAO_PROCESSOS'] = os.cpu_count() or 1
+    tarefas.consumir_fila(intervalo, uma_vez)
+
+
+@click.command('inicializar-banco')
+@click.option('--aguardar', type=int, default=0,
+              help='Segundos à espera do banco subir antes de desistir (útil no docker compose).')
+@with_appcontext
+def inicializar_banco_comando(aguardar):
+    liberar_tempo_limite()
+    limite = time.monotonic() + aguardar
+    while True:
+        try:
+            with db.engine.connect():
+                break
+        except OperationalError:
+            if time.monotonic() >= limite:
+                raise
+            print("Banco indisponível, tentando de novo...")
+            time.sleep(1)
+    inicializar_banco()
+
+
+@click.command('migrar-marcacoes')
+@with_appcontext
+@click.option('--para', 'destino', type=click.Choice(MODOS), required=True)
+@click.option('--descartar-desconhecidas', is_flag=True,
+              help='Converte para bits mesmo com chaves fora do vocabulário (elas se perdem).')
+def migrar_marcacoes_comando(destino, descartar_desconhecidas):
+    liberar_tempo_limite()
+    try:
+        resultado = converter_marcacoes(destino, descartar_desconhecidas)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not resultado['convertido']:
+        print(f"O banco já está no modo {destino}.")
+        return
+    if resultado['chaves_descartadas']:
+        print(f"Chaves descartadas: {resultado['chaves_descartadas']}")
+    if resultado['tamanho_antes_bytes'] is not None:
+        print(f"Tamanho de fichas: {resultado['tamanho_antes_bytes']} -> {resultado['tamanho_depois_bytes']} bytes")
+    print(f"Marcações convertidas para {destino}. Defina MARCACOES_ARMAZENAMENTO={destino} e reinicie o app.")
+
+
+@click.command('verificar-uploads')
+@with_appcontext
+@click.option('--quarentena', 'acao', flag_value='quarentena', help='Move os órfãos para UPLOADS_QUARENTENA_PASTA.')
+@click.option('--excluir', 'acao', flag_value='excluir', help='Apaga os órfãos.')
+@click.option('--idade-minima', type=int, default=None,
+              help='Segundos; arquivos mais novos são ignorados (padrão: UPLOADS_IDADE_MINIMA).')
+@click.option('--json', 'como_json', is_flag=True, help='Imprime o relatório completo em JSON.')
+def verificar_uploads_comando(acao, idade_minima, como_json):
+    relatorio = armazenamento.verificar(
+        acao or 'relatorio',
+        current_app.config['UPLOADS_IDADE_MINIMA'] if idade_minima is None else idade_minima,
+        current_app.config['UPLOADS_QUARENTENA_PASTA'])
+    if como_json:
+        print(json.dumps(relatorio, ensure_ascii=False, indent=2))
+        return
+    orfaos, quebradas = relatorio['orfaos'], relatorio['referencias_quebradas']
+    print(f"Uploads: {relatorio['arquivos']} arquivos, {relatorio['bytes']} bytes "
+          f"({relatorio['referenciados']['arquivos']} referenciados).")
+    print(f"Órfãos: {orfaos['arquivos']} arquivos, {orfaos['bytes']} bytes "
+          f"({orfaos['recentes_ignorados']} recentes ignorados); "
+          f"rendições órfãs: {relatorio['rendicoes']['orfas']}.")
+    print(f"Referências quebradas: {quebradas['total']}.")
+    for item in quebradas['amostra']:
+        print(f"  ficha {item['numero_ficha']} (id {item['ficha_id']}): {item['caminho']}")
+    for secao, dados in relatorio['por_secao'].items():
+        print(f"  {secao}: {dados['fichas']} fichas, {dados['arquivos']} imagens, {dados['bytes']} bytes")
+    if 'tratados' in relatorio:
+        destino = f" para {relatorio['pasta_quarentena']}" if acao == 'quarentena' else ''
+        print(f"{relatorio['tratados']} arquivos {'movidos' if acao == 'quarentena' else 'apagados'}{destino}.")
+
+
+COMANDOS = (criar_indices_comando, reconstruir_estatisticas_comando, executar_tarefas_comando,
+            inicializar_banco_comando, migrar_marcacoes_comando, verificar_uploads_comando)
+
+
+def registrar(app):
+    for comando in COMANDOS:
+        app.cli.add_command(comando)
@@ -0,0 +1,96 @@
+import os
+
+
+def _bool(valor):
+    return str(valor).lower() in ('1', 'true', 'sim', 'yes', 'on')
+
+
+def conexoes_em_segundo_plano():
+    # cada tarefa em thread usa a sessão, a gravação do progresso e o sinal
+    # de vida; cada thread de imagens, mais uma
+    tarefas = int(os.getenv('TAREFAS_WORKERS', 2))
+    return tarefas * 3 + int(os.getenv('IMAGENS_WORKERS', 2))
+
+
+def opcoes_engine(uri):
+    opcoes = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', max(10, conexoes_em_segundo_plano()))),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': _bool(os.getenv('DB_POOL_PRE_PING', 'true')),
+    }
+    # vale para as requisições e tarefas; os comandos de manutenção o retiram
+    # (comandos.liberar_tempo_limite)
+    timeout_ms = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    if timeout_ms and uri.startswith('postgresql'):
+        opcoes['connect_args'] = {'options': f'-c statement_timeout={timeout_ms}'}
+    if uri.startswith('sqlite'):
+        # SQLite não usa QueuePool com tamanho configurável
+        for chave in ('pool_size', 'max_overflow', 'pool_timeout'):
+            opcoes.pop(chave)
+    return opcoes
+
+
+class Config:
+    SECRET_KEY = os.getenv('SECRET_KEY', 'chave_super_secreta_do_museu')
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'postgresql://usuario:senha@db:5432/fichas_db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = opcoes_engine(SQLALCHEMY_DATABASE_URI)
+
+    # cria/atualiza tabelas e índices na primeira requisição; em produção isso
+    # é feito uma vez por 'flask inicializar-banco' antes de subir os workers
+    INICIALIZAR_BANCO_AO_INICIAR = True
+
+    IMPORTACAO_TAMANHO_LOTE = int(os.getenv('IMPORTACAO_TAMANHO_LOTE', 1000))
+    # a planilha é lida em blocos de IMPORTACAO_TAMANHO_BLOCO linhas, normalizados
+    # em IMPORTACAO_PROCESSOS processos (1 = no próprio processo). Nos workers
+    # web fica em 1: fork de um processo com threads e conexões abertas não é
+    # seguro, e uma importação tomaria todos os núcleos do servidor; o
+    # 'flask executar-tarefas' usa todos os núcleos se a variável não for definida
+    IMPORTACAO_TAMANHO_BLOCO = int(os.getenv('IMPORTACAO_TAMANHO_BLOCO', 20000))
+    IMPORTACAO_PROCESSOS = int(os.getenv('IMPORTACAO_PROCESSOS', 1))
+    IMAGENS_WORKERS = int(os.getenv('IMAGENS_WORKERS', 2))
+    TAREFAS_MODO = os.getenv('TAREFAS_MODO', 'thread')
+    TAREFAS_WORKERS = int(os.getenv('TAREFAS_WORKERS', 2))
+    TAREFAS_PASTA = os.getenv('TAREFAS_PASTA')
+    # a tarefa em execução grava um sinal de vida a cada TAREFAS_INTERVALO_BATIMENTO
+    # segundos; sem sinal há mais de TAREFAS_LIMITE_SEM_BATIMENTO, o processo que
+    # a executava morreu (worker reciclado, deploy) e ela é dada como interrompida
+    TAREFAS_INTERVALO_BATIMENTO = int(os.getenv('TAREFAS_INTERVALO_BATIMENTO', 30))
+    TAREFAS_LIMITE_SEM_BATIMENTO = int(os.getenv('TAREFAS_LIMITE_SEM_BATIMENTO', 300))
+
+    # coleta de uploads órfãos (flask verificar-uploads): arquivos mais novos
+    # que isso podem ser de uma ficha ainda sendo gravada e nunca são tocados
+    UPLOADS_IDADE_MINIMA = int(os.getenv('UPLOADS_IDADE_MINIMA', 3600))
+    UPLOADS_QUARENTENA_PASTA = os.getenv('UPLOADS_QUARENTENA_PASTA')
+
+    CACHE_LIMITE_BYTES = int(os.getenv('CACHE_LIMITE_BYTES', 64 * 1024 * 1024))
+    # '' (só LRU local), 'local' (substituto em memória) ou uma URL redis://
+    CACHE_COMPARTILHADO = os.getenv('CACHE_COMPARTILHADO', '')
+    CACHE_TTL = int(os.getenv('CACHE_TTL', 3600))
+
+    # 'jsonb' ou 'bits' (ver app/vocabulario.py); trocar exige 'flask migrar-marcacoes'
+    MARCACOES_ARMAZENAMENTO = os.getenv('MARCACOES_ARMAZENAMENTO', 'jsonb')
+
+    INSTRUMENTACAO_SQL_LENTO_MS = int(os.getenv('INSTRUMENTACAO_SQL_LENTO_MS', 200))
+    INSTRUMENTACAO_REQUISICAO_LENTA_MS = int(os.getenv('INSTRUMENTACAO_REQUISICAO_LENTA_MS', 1000))
+
+
+class ConfigDesenvolvimento(Config):
+    DEBUG = True
+
+
+class ConfigProducao(Config):
+    DEBUG = False
+    INICIALIZAR_BANCO_AO_INICIAR = _bool(os.getenv('INICIALIZAR_BANCO_AO_INICIAR', 'false'))
+
+
+PERFIS = {
+    'desenvolvimento': ConfigDesenvolvimento,
+    'producao': ConfigProducao,
+}
+
+
+def carregar_perfil(perfil=None):
+    return PERFIS.get(perfil or os.getenv('APP_PERFIL', 'desenvolvimento'), ConfigDesenvolvimento)
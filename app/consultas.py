@@ -0,0 +1,112 @@
+from datetime import datetime
+from sqlalchemy import not_
+from .models import db, Ficha, GRUPOS_CHECKBOX
+from .vocabulario import filtro_marcadas
+
+POR_PAGINA_PADRAO = 50
+POR_PAGINA_MAXIMO = 200
+
+# Apenas as colunas exibidas na tabela do acervo (sem os JSONB e sem observacoes)
+COLUNAS_LISTAGEM = (
+    Ficha.id,
+    Ficha.numero_ficha,
+    Ficha.titulo,
+    Ficha.autor,
+    Ficha.data_preenchimento,
+)
+
+
+def _ler_data(valor):
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def ler_inteiro(valor, padrao=None):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return padrao
+
+
+def ler_condicoes(args):
+    # ?deterioracoes=fungos&sem_tratamento_volumes=fumigacao
+    #   -> deterioracoes @> '{"fungos": true}' AND NOT tratamento_volumes @> '{"fumigacao": true}'
+    condicoes = {}
+    for grupo in GRUPOS_CHECKBOX:
+        com = [c.strip() for c in args.getlist(grupo) if c.strip()]
+        sem = [c.strip() for c in args.getlist(f'sem_{grupo}') if c.strip()]
+        if com or sem:
+            condicoes[grupo] = {'com': com, 'sem': sem}
+    return condicoes
+
+
+def ler_filtros(args):
+    return {
+        'titulo': (args.get('titulo') or '').strip(),
+        'autor': (args.get('autor') or '').strip(),
+        'secao_guarda': (args.get('secao_guarda') or '').strip(),
+        'avaliacao': ler_inteiro(args.get('avaliacao')),
+        'data_inicio': _ler_data(args.get('data_inicio')),
+        'data_fim': _ler_data(args.get('data_fim')),
+        'condicoes': ler_condicoes(args),
+    }
+
+
+def aplicar_filtros(query, filtros):
+    if filtros['titulo']:
+        query = query.filter(Ficha.titulo.ilike(f"%{filtros['titulo']}%"))
+    if filtros['autor']:
+        query = query.filter(Ficha.autor.ilike(f"%{filtros['autor']}%"))
+    if filtros['secao_guarda']:
+        query = query.filter(Ficha.secao_guarda.ilike(filtros['secao_guarda']))
+    if filtros['avaliacao'] in (1, 2, 3):
+        query = query.filter(Ficha.avaliacao == filtros['avaliacao'])
+    if filtros['data_inicio']:
+        query = query.filter(Ficha.data_preenchimento >= filtros['data_inicio'])
+    if filtros['data_fim']:
+        query = query.filter(Ficha.data_preenchimento <= filtros['data_fim'])
+    for grupo, criterios in filtros.get('condicoes', {}).items():
+        coluna = getattr(Ficha, grupo)
+        if criterios['com']:
+            # uma única condição por grupo com todas as chaves exigidas
+            # (@> com índice GIN no modo 'jsonb', máscara de bits no modo 'bits')
+            query = query.filter(filtro_marcadas(coluna, grupo, criterios['com']))
+        for chave in criterios['sem']:
+            query = query.filter(not_(filtro_marcadas(coluna, grupo, [chave])))
+    return query
+
+
+def paginar_keyset(query, cursor=None, por_pagina=POR_PAGINA_PADRAO):
+    # Paginação por cursor no id (ordem decrescente): o custo de cada página
+    # não depende de quantas fichas vieram antes, ao contrário de OFFSET.
+    if cursor:
+        query = query.filter(Ficha.id < cursor)
+    linhas = query.order_by(Ficha.id.desc()).limit(por_pagina + 1).all()
+
+    proximo_cursor = None
+    if len(linhas) > por_pagina:
+        linhas = linhas[:por_pagina]
+        proximo_cursor = linhas[-1].id
+    return linhas, proximo_cursor
+
+
+def listar_pagina(args):
+    filtros = ler_filtros(args)
+    cursor = ler_inteiro(args.get('depois'))
+    por_pagina = ler_inteiro(args.get('por_pagina'), POR_PAGINA_PADRAO)
+    por_pagina = max(1, min(por_pagina, POR_PAGINA_MAXIMO))
+
+    query = aplicar_filtros(db.session.query(*COLUNAS_LISTAGEM), filtros)
+    linhas, proximo_cursor = paginar_keyset(query, cursor, por_pagina)
+    return linhas, proximo_cursor, filtros
+
+
+def linha_para_dict(linha):
+    dados = linha._asdict()
+    if dados.get('data_preenchimento'):
+        dados['data_preenchimento'] = dados['data_preenchimento'].isoformat()
+    return dados
@@ -0,0 +1,129 @@
+from collections import Counter
+from sqlalchemy import Integer, case, func, select, type_coerce
+from .models import db, Ficha, Estatistica, insert_dialeto
+from .exportacao import mapa_material, mapa_deterioracoes, mapa_plano, mapa_volume
+from .vocabulario import MODO, POSICOES
+
+# dimensões mantidas na tabela 'estatisticas' (além do total de fichas)
+GRUPOS_ESTATISTICA = {
+    'especificacao_material': 'material',
+    'deterioracoes': 'deterioracao',
+    'tratamento_planos': 'tratamento_planos',
+    'tratamento_volumes': 'tratamento_volumes',
+}
+
+COLUNAS_ESTATISTICA = ['avaliacao', 'secao_guarda'] + list(GRUPOS_ESTATISTICA)
+
+ROTULOS = {
+    'avaliacao': {'1': 'Bom', '2': 'Regular', '3': 'Mau'},
+    'material': mapa_material,
+    'deterioracao': mapa_deterioracoes,
+    'tratamento_planos': mapa_plano,
+    'tratamento_volumes': mapa_volume,
+}
+
+
+def _valor(dados, campo):
+    if isinstance(dados, dict):
+        return dados.get(campo)
+    return getattr(dados, campo)
+
+
+def contribuicoes(dados):
+    """Pares (dimensao, chave) que uma ficha soma aos contadores.
+
+    Aceita uma Ficha ou um dict com as mesmas colunas (linhas da importação).
+    """
+    pares = [('total', 'fichas')]
+
+    avaliacao = _valor(dados, 'avaliacao')
+    pares.append(('avaliacao', str(avaliacao) if avaliacao in (1, 2, 3, '1', '2', '3') else '2'))
+    pares.append(('secao_guarda', (_valor(dados, 'secao_guarda') or '').strip()))
+
+    for coluna, dimensao in GRUPOS_ESTATISTICA.items():
+        for chave, marcado in (_valor(dados, coluna) or {}).items():
+            if chave != 'outro_texto' and marcado is True:
+                pares.append((dimensao, chave))
+    return pares
+
+
+def ajustar(contador):
+    # Um único INSERT ... ON CONFLICT DO UPDATE soma os deltas; o incremento
+    # acontece no banco, então requisições simultâneas não se sobrescrevem
+    # ordem fixa das linhas: gravações simultâneas travam os contadores na
+    # mesma sequência e não entram em deadlock
+    valores = [{'dimensao': d, 'chave': c[:200], 'total': delta}
+               for (d, c), delta in sorted(contador.items()) if delta]
+    if not valores:
+        return
+    stmt = insert_dialeto(Estatistica).values(valores)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['dimensao', 'chave'],
+        set_={'total': Estatistica.total + stmt.excluded.total}
+    )
+    db.session.execute(stmt)
+
+
+def registrar_alteracao(antes=None, depois=None):
+    contador = Counter()
+    if antes is not None:
+        contador.subtract(contribuicoes(antes))
+    if depois is not None:
+        contador.update(contribuicoes(depois))
+    ajustar(contador)
+
+
+def registrar_lote(linhas):
+    contador = Counter()
+    for linha in linhas:
+        contador.update(contribuicoes(linha))
+    ajustar(contador)
+
+
+def instantaneo(ficha):
+    # cópia dos valores que entram nas estatísticas, antes de a ficha ser alterada
+    return {coluna: getattr(ficha, coluna) for coluna in COLUNAS_ESTATISTICA}
+
+
+def _contar_bits():
+    # modo 'bits': as contagens por chave saem de uma única varredura com
+    # somas de máscaras, sem decodificar linha a linha no Python
+    contador = Counter()
+    contador[('total', 'fichas')] = db.session.query(func.count(Ficha.id)).scalar()
+    for avaliacao, total in db.session.query(Ficha.avaliacao, func.count()).group_by(Ficha.avaliacao):
+        contador[('avaliacao', str(avaliacao) if avaliacao in (1, 2, 3) else '2')] += total
+    for secao, total in db.session.query(Ficha.secao_guarda, func.count()).group_by(Ficha.secao_guarda):
+        contador[('secao_guarda', (secao or '').strip())] += total
+
+    pares, somas = [], []
+    for coluna, dimensao in GRUPOS_ESTATISTICA.items():
+        bits = type_coerce(getattr(Ficha, coluna), Integer)
+        for chave, posicao in POSICOES[coluna].items():
+            pares.append((dimensao, chave))
+            somas.append(func.sum(case((bits.op('&')(1 << posicao) != 0, 1), else_=0)))
+    for par, total in zip(pares, db.session.query(*somas).one()):
+        contador[par] += total or 0
+    return contador
+
+
+def reconstruir(tamanho_lote=1000):
+    if MODO == 'bits':
+        contador = _contar_bits()
+    else:
+        contador = Counter()
+        colunas = [getattr(Ficha, c) for c in COLUNAS_ESTATISTICA]
+        stmt = select(*colunas).execution_options(yield_per=tamanho_lote)
+        for linha in db.session.execute(stmt):
+            contador.update(contribuicoes(linha._asdict()))
+
+    db.session.query(Estatistica).delete()
+    ajustar(contador)
+    db.session.commit()
+    return sum(1 for _ in contador)
+
+
+def carregar():
+    resultado = {}
+    for e in Estatistica.query.filter(Estatistica.total > 0):
+        resultado.setdefault(e.dimensao, {})[e.chave] = e.total
+    return resultado
@@ -0,0 +1,168 @@
+import csv
+import io
+import os
+import tempfile
+from sqlalchemy import select
+from .models import db, Ficha, carregar_imagens
+from .vocabulario import rotulos
+
+TAMANHO_LOTE_EXPORTACAO = 500
+LINHAS_AMOSTRA_LARGURA = 200
+LARGURA_MAXIMA = 50
+
+FORMATOS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'Relatorio_Resumido.xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'Relatorio_Resumido.csv'),
+    'tsv': ('text/tab-separated-values; charset=utf-8', 'Relatorio_Resumido.tsv'),
+}
+
+COLUNAS_EXPORTACAO = [
+    'ID', 'Título', 'Autor', 'Avaliação', 'Especificação do Material',
+    'Tipo de Suporte', 'Estado de Conservação', 'Deteriorações',
+    'Tratamento (Planos)', 'Tratamento (Volumes)', 'Observações', 'Técnico', 'Foto',
+    'Registro', 'Nº Chamada', 'Seção', 'Data Obra', 'Páginas', 'Dimensões', 'Data Preenchimento'
+]
+
+mapa_material = rotulos('especificacao_material')
+mapa_suporte = rotulos('tipo_suporte')
+mapa_estado = rotulos('estado_conservacao')
+mapa_deterioracoes = rotulos('deterioracoes')
+mapa_plano = rotulos('tratamento_planos')
+mapa_volume = rotulos('tratamento_volumes')
+
+
+def processar_multiplos(dados_json, mapa_nomes):
+    if not dados_json: return ""
+    itens_encontrados = []
+    for chave_db, nome_legivel in mapa_nomes.items():
+        if dados_json.get(chave_db):
+            itens_encontrados.append(nome_legivel)
+    outro = dados_json.get('outro_texto')
+    if outro and str(outro).strip():
+        itens_encontrados.append(f"Outro: {outro}")
+    return ", ".join(itens_encontrados)
+
+
+def traduzir_avaliacao(valor):
+    if valor == 1: return "Bom"
+    if valor == 3: return "Mau"
+    return "Regular"
+
+
+def ficha_para_linha(f):
+    caminhos_imagens = "; ".join([img.caminho for img in f.imagens])
+    linha = {
+        'ID': f.numero_ficha,
+        'Avaliação': traduzir_avaliacao(f.avaliacao),
+        'Autor': f.autor,
+        'Título': f.titulo,
+        'Registro': f.registro,
+        'Nº Chamada': f.n_chamada,
+        'Seção': f.secao_guarda,
+        'Data Obra': f.data_obra,
+        'Páginas': f.paginas,
+        'Dimensões': f.dimensoes,
+        'Especificação do Material': processar_multiplos(f.marcacoes('especificacao_material'), mapa_material),
+        'Tipo de Suporte': processar_multiplos(f.marcacoes('tipo_suporte'), mapa_suporte),
+        'Estado de Conservação': processar_multiplos(f.marcacoes('estado_conservacao'), mapa_estado),
+        'Deteriorações': processar_multiplos(f.marcacoes('deterioracoes'), mapa_deterioracoes),
+        'Tratamento (Planos)': processar_multiplos(f.marcacoes('tratamento_planos'), mapa_plano),
+        'Tratamento (Volumes)': processar_multiplos(f.marcacoes('tratamento_volumes'), mapa_volume),
+        'Observações': f.observacoes,
+        'Técnico': f.tecnico_nome,
+        'Data Preenchimento': f.data_preenchimento,
+        'Foto': caminhos_imagens
+    }
+    return [linha[c] for c in COLUNAS_EXPORTACAO]
+
+
+def iterar_fichas(tamanho_lote=TAMANHO_LOTE_EXPORTACAO, desde=None, ate=None):
+    # yield_per liga stream_results: o driver usa cursor no servidor e só
+    # um lote de fichas fica em memória por vez; as imagens vêm num único
+    # SELECT ... IN por lote em vez de uma consulta por ficha
+    stmt = (select(Ficha)
+            .options(carregar_imagens('lote'))
+            .order_by(Ficha.id)
+            .execution_options(yield_per=tamanho_lote))
+    # exportação incremental: só o que mudou na faixa (desde, ate] da sequência
+    if desde is not None:
+        stmt = stmt.where(Ficha.seq_alteracao > desde)
+    if ate is not None:
+        stmt = stmt.where(Ficha.seq_alteracao <= ate)
+    for ficha in db.session.execute(stmt).scalars():
+        yield ficha
+
+
+def iterar_linhas(tamanho_lote=TAMANHO_LOTE_EXPORTACAO, desde=None, ate=None):
+    for ficha in iterar_fichas(tamanho_lote, desde, ate):
+        yield ficha_para_linha(ficha)
+
+
+def gerar_texto(linhas, delimitador=','):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimitador)
+
+    # BOM para o Excel reconhecer UTF-8
+    yield '\ufeff'.encode('utf-8')
+    writer.writerow(COLUNAS_EXPORTACAO)
+    for i, linha in enumerate(linhas, start=1):
+        writer.writerow(['' if v is None else v for v in linha])
+        if i % TAMANHO_LOTE_EXPORTACAO == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _larguras_por_amostra(amostra):
+    larguras = []
+    for i, coluna in enumerate(COLUNAS_EXPORTACAO):
+        tamanho = max([len(coluna)] + [len(str(l[i])) for l in amostra if l[i] is not None])
+        larguras.append(min(tamanho, LARGURA_MAXIMA) + 2)
+    return larguras
+
+
+def gerar_xlsx(linhas, tamanho_bloco=64 * 1024):
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    linhas = iter(linhas)
+    amostra = []
+    for linha in linhas:
+        amostra.append(linha)
+        if len(amostra) >= LINHAS_AMOSTRA_LARGURA:
+            break
+
+    # Workbook write-only grava as linhas direto em disco; as larguras
+    # precisam ser definidas antes da primeira linha, daí a amostra
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Acervo Consolidado')
+    for i, largura in enumerate(_larguras_por_amostra(amostra), start=1):
+        ws.column_dimensions[get_column_letter(i)].width = largura
+
+    ws.append(COLUNAS_EXPORTACAO)
+    for linha in amostra:
+        ws.append(linha)
+    for linha in linhas:
+        ws.append(linha)
+
+    fd, caminho = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        wb.save(caminho)
+        with open(caminho, 'rb') as arquivo:
+            while True:
+                bloco = arquivo.read(tamanho_bloco)
+                if not bloco:
+                    break
+                yield bloco
+    finally:
+        os.remove(caminho)
+
+
+def gerar_exportacao(formato, linhas):
+    if formato == 'csv':
+        return gerar_texto(linhas, ',')
+    if formato == 'tsv':
+        return gerar_texto(linhas, '\t')
+    return gerar_xlsx(linhas)
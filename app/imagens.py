@@ -0,0 +1,213 @@
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.utils import secure_filename
+from .models import db, Imagem
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+STATIC_FOLDER = os.path.join('app', 'static')
+UPLOAD_FOLDER = os.path.join(STATIC_FOLDER, 'uploads')
+RENDICOES_FOLDER = os.path.join(UPLOAD_FOLDER, 'rendicoes')
+
+TAMANHO_BLOCO = 64 * 1024
+
+# rendição -> maior lado em pixels
+RENDICOES = {
+    'miniatura': 160,
+    'previa': 1024,
+}
+
+_executor = None
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def caminho_absoluto(caminho_relativo):
+    return os.path.join(STATIC_FOLDER, caminho_relativo)
+
+
+def gravar_com_hash(arquivo, extensao):
+    # grava o upload em blocos num arquivo temporário calculando o SHA-256;
+    # o nome final é o próprio hash, então fotos repetidas ocupam um só arquivo
+    temporario = os.path.join(UPLOAD_FOLDER, f".{uuid.uuid4().hex}.tmp")
+    sha = hashlib.sha256()
+    tamanho = 0
+    with open(temporario, 'wb') as destino:
+        while True:
+            bloco = arquivo.stream.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            sha.update(bloco)
+            destino.write(bloco)
+            tamanho += len(bloco)
+
+    conteudo_hash = sha.hexdigest()
+    nome = f"{conteudo_hash}.{extensao}"
+    final = os.path.join(UPLOAD_FOLDER, nome)
+    if os.path.exists(final):
+        os.remove(temporario)
+        # arquivo reaproveitado: a data nova impede que a coleta de órfãos o
+        # apague antes de a ficha que o usa ser gravada
+        os.utime(final)
+    else:
+        os.replace(temporario, final)
+    return f"uploads/{nome}", conteudo_hash, tamanho
+
+
+def gravar_arquivos(lista_arquivos):
+    # grava os uploads no disco antes da transação da ficha; devolve as
+    # linhas de 'imagens' a inserir (sem repetir o mesmo conteúdo)
+    gravados = {}
+    for arquivo in lista_arquivos:
+        if arquivo and allowed_file(arquivo.filename):
+            filename = secure_filename(arquivo.filename)
+            extensao = filename.rsplit('.', 1)[1].lower()
+            try:
+                caminho_relativo, conteudo_hash, tamanho = gravar_com_hash(arquivo, extensao)
+                gravados.setdefault(conteudo_hash, {'caminho': caminho_relativo, 'hash': conteudo_hash,
+                                                    'tamanho_bytes': tamanho})
+            except Exception as e:
+                print(f"Erro ao salvar imagem {filename}: {e}")
+    return list(gravados.values())
+
+
+def chave_rendicao(imagem):
+    return imagem.hash or hashlib.sha1(imagem.caminho.encode('utf-8')).hexdigest()
+
+
+def caminho_rendicao(imagem, rendicao):
+    return os.path.join(RENDICOES_FOLDER, f"{chave_rendicao(imagem)}_{rendicao}.jpg")
+
+
+def gerar_rendicao(imagem, rendicao):
+    """Gera (ou reaproveita do disco) a rendição; devolve o caminho ou None."""
+    destino = caminho_rendicao(imagem, rendicao)
+    if os.path.exists(destino):
+        return destino
+
+    origem = caminho_absoluto(imagem.caminho)
+    if not os.path.exists(origem):
+        return None
+
+    from PIL import Image
+
+    with Image.open(origem) as img:
+        img.thumbnail((RENDICOES[rendicao], RENDICOES[rendicao]))
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        temporario = f"{destino}.{uuid.uuid4().hex}.tmp"
+        img.save(temporario, 'JPEG', quality=82, optimize=True)
+        os.replace(temporario, destino)
+    return destino
+
+
+def _ler_dimensoes(caminho):
+    from PIL import Image
+
+    with Image.open(caminho) as img:
+        return img.size
+
+
+def processar_imagens(ids):
+    for imagem in Imagem.query.filter(Imagem.id.in_(ids)):
+        origem = caminho_absoluto(imagem.caminho)
+        if not os.path.exists(origem):
+            continue
+        try:
+            if imagem.largura is None:
+                largura, altura = _ler_dimensoes(origem)
+                (Imagem.query.filter(Imagem.caminho == imagem.caminho)
+                 .update({'largura': largura, 'altura': altura,
+                          'tamanho_bytes': os.path.getsize(origem)}))
+            for rendicao in RENDICOES:
+                gerar_rendicao(imagem, rendicao)
+        except Exception as e:
+            print(f"Erro ao processar imagem {imagem.caminho}: {e}")
+    db.session.commit()
+
+
+def _processar_em_contexto(app, ids):
+    with app.app_context():
+        try:
+            processar_imagens(ids)
+        finally:
+            db.session.remove()
+
+
+def _executor_imagens():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=current_app.config['IMAGENS_WORKERS'],
+                                       thread_name_prefix='imagens')
+    return _executor
+
+
+def agendar_processamento(ids):
+    # miniaturas e dimensões são calculadas fora da requisição
+    if not ids:
+        return
+    _executor_imagens().submit(_processar_em_contexto, current_app._get_current_object(), ids)
+
+
+def remover_sem_uso(imagens, tamanho_lote=1000, idade_minima=None):
+    """Apaga do disco os arquivos (e rendições) que nenhuma linha de 'imagens' referencia mais.
+
+    'imagens': objetos com caminho e hash, de linhas já excluídas do banco.
+    Arquivos modificados há menos de idade_minima segundos (padrão:
+    UPLOADS_IDADE_MINIMA) ficam para a coleta de órfãos.
+    """
+    if idade_minima is None:
+        idade_minima = current_app.config['UPLOADS_IDADE_MINIMA']
+    # a mesma foto pode estar em várias fichas (deduplicação por hash); a
+    # consulta é feita depois do commit da exclusão, então só sobra o que
+    # outras fichas ainda usam
+    por_caminho = {img.caminho: img for img in imagens}
+    caminhos = list(por_caminho)
+    em_uso = set()
+    for inicio in range(0, len(caminhos), tamanho_lote):
+        em_uso.update(c for (c,) in db.session.query(Imagem.caminho).distinct()
+                      .filter(Imagem.caminho.in_(caminhos[inicio:inicio + tamanho_lote])))
+    limite = time.time() - idade_minima
+    removidos = 0
+    for caminho, imagem in por_caminho.items():
+        if caminho in em_uso:
+            continue
+        # um upload do mesmo conteúdo reaproveita o arquivo (gravar_com_hash
+        # atualiza a data) antes de a ficha dele ser gravada: a consulta
+        # acima ainda não o vê
+        try:
+            if os.stat(caminho_absoluto(caminho)).st_mtime > limite:
+                continue
+        except FileNotFoundError:
+            pass
+        for arquivo in [caminho_absoluto(caminho)] + [caminho_rendicao(imagem, r) for r in RENDICOES]:
+            try:
+                os.remove(arquivo)
+                removidos += 1
+            except FileNotFoundError:
+                pass
+    return removidos
+
+
+def _remover_em_contexto(app, imagens):
+    with app.app_context():
+        try:
+            removidos = remover_sem_uso(imagens)
+            print(f"Limpeza de imagens: {removidos} arquivos removidos.")
+        except Exception as e:
+            print(f"Erro na limpeza de imagens: {e}")
+        finally:
+            db.session.remove()
+
+
+def agendar_remocao(imagens):
+    # chamado só depois do commit: se a exclusão voltar atrás, nenhum
+    # arquivo é apagado
+    if not imagens:
+        return
+    _executor_imagens().submit(_remover_em_contexto, current_app._get_current_object(), list(imagens))
@@ -0,0 +1,497 @@
+import csv
+import itertools
+import multiprocessing
+import warnings
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+from .models import db, Ficha, Imagem, insert_dialeto
+from .estatisticas import registrar_lote
+from .sincronizacao import numerar
+from .vocabulario import mapa_importacao, separar_outros
+
+TAMANHO_LOTE_PADRAO = 1000
+TAMANHO_BLOCO_PADRAO = 20000
+# bytes do início do CSV usados para descobrir o delimitador
+AMOSTRA_DELIMITADOR = 64 * 1024
+DELIMITADORES = ',;\t|'
+
+VALORES_VERDADEIROS = ['sim', 's', 'true', 'x', 'yes', 'checked', 'on', 'verdadeiro']
+# só para a validação: na importação tudo que não é verdadeiro vale como desmarcado
+VALORES_FALSOS = ['não', 'nao', 'n', 'false', 'no', 'unchecked', 'off', 'falso', '']
+VALORES_AVALIACAO = ['1', '2', '3', 'bom', 'regular', 'mau', 'ruim']
+
+# grupo JSONB -> {chave no banco: colunas da planilha (basta uma marcada)}
+MAPA_IMPORTACAO = mapa_importacao()
+
+TIPOS_ENCADERNADA = ['encadernada', 'inteira', 'meia', 'holandesa', 'capa']
+
+# campo texto da ficha -> coluna da planilha, para conferir o tamanho
+CAMPOS_TEXTO = {
+    'numero_ficha': 'numero_ficha', 'autor': 'autor', 'titulo': 'titulo', 'registro': 'registro',
+    'n_chamada': 'num_chamada', 'secao_guarda': 'secao_guarda', 'data_obra': 'data_obra',
+    'paginas': 'num_paginas', 'dimensoes': 'dimensoes', 'tecnico_nome': 'tecnico',
+}
+COLUNAS_MARCACAO = sorted({nome for chaves in MAPA_IMPORTACAO.values() for lista in chaves.values() for nome in lista})
+COLUNAS_CONHECIDAS = (
+    {'id', 'numero_ficha', 'estado_geral', 'enc_tipo', 'data_final', 'Imagem 1', 'foto_path', 'observacoes'}
+    | set(CAMPOS_TEXTO.values()) | set(COLUNAS_MARCACAO)
+)
+
+PROBLEMAS = {
+    'coluna_desconhecida': 'coluna não usada pela importação; o conteúdo é descartado',
+    'sem_numero': 'linha sem número de ficha; será ignorada',
+    'duplicada_no_arquivo': 'número repetido no arquivo; só a primeira ocorrência é importada',
+    'ja_cadastrada': 'número já cadastrado; a linha será ignorada',
+    'data_invalida': 'data não reconhecida; será gravada a data da importação',
+    'avaliacao_invalida': 'estado geral não reconhecido; será gravado como Regular',
+    'marcacao_invalida': 'valor não reconhecido como sim/não; a opção fica desmarcada',
+    'texto_longo': 'texto maior que o campo; o lote inteiro falharia ao gravar',
+}
+COLUNAS_RELATORIO = ['linha', 'numero_ficha', 'problema', 'coluna', 'valor', 'descricao']
+LIMITE_AMOSTRA_VALIDACAO = 50
+
+
+def _coluna(df, nome):
+    if nome in df.columns:
+        return df[nome]
+    return pd.Series(pd.NA, index=df.index, dtype='object')
+
+
+def converter_booleano_coluna(serie):
+    if pd.api.types.is_bool_dtype(serie):
+        return serie.fillna(False).astype(bool)
+    # uma coluna de checkbox tem poucos valores distintos: converte cada um
+    # uma vez e marca as linhas pelo isin
+    distintos = pd.Series(serie.dropna().unique(), dtype=object)
+    texto = distintos.astype(str).str.strip().str.lower()
+    numeros = pd.to_numeric(texto.str.replace(',', '.', regex=False), errors='coerce')
+    marcados = numeros.gt(0).where(numeros.notna(), texto.isin(VALORES_VERDADEIROS)).astype(bool)
+    return serie.isin(distintos[marcados]).astype(bool)
+
+
+def converter_avaliacao_coluna(serie):
+    texto = serie.astype(str).str.strip().str.lower()
+    avaliacao = pd.Series(2, index=serie.index)
+    avaliacao[texto.isin(['1', 'bom'])] = 1
+    avaliacao[texto.isin(['3', 'mau', 'ruim'])] = 3
+    return avaliacao.where(serie.notna(), 2).astype(int)
+
+
+def _texto_coluna(serie, remover_decimal=False):
+    texto = serie.astype(str)
+    if remover_decimal:
+        texto = texto.str.replace('.0', '', regex=False)
+    texto = texto.str.replace('nan', '', regex=False)
+    return texto.where(serie.notna(), '')
+
+
+def converter_datas(serie):
+    """Data de cada valor da coluna, ou None quando não dá para interpretar.
+
+    Cada valor distinto é interpretado sozinho, como na importação linha a
+    linha: um to_datetime sobre a coluna inteira deduz o formato pelo
+    primeiro valor e descarta os que vierem em outro formato.
+    """
+    datas = {}
+    with warnings.catch_warnings():
+        # aviso de dayfirst, repetido para cada valor dd/mm/aaaa
+        warnings.simplefilter('ignore', UserWarning)
+        for valor in serie.dropna().unique():
+            try:
+                data = pd.to_datetime(valor)
+            except (ValueError, TypeError, OverflowError):
+                continue
+            if not pd.isna(data):
+                datas[valor] = data.date()
+    convertidas = serie.map(datas).astype(object)
+    return convertidas.where(convertidas.notna(), None)
+
+
+def _valor_ou_none(serie):
+    return serie.astype(object).where(serie.notna(), None)
+
+
+def normalizar_dataframe(df):
+    df = df.copy()
+    df.columns = df.columns.str.strip()
+
+    val_id = _coluna(df, 'id') if 'id' in df.columns else _coluna(df, 'numero_ficha')
+    numero = val_id.astype(str).str.split('.').str[0].str.strip()
+    # só numa coluna inteiramente numérica os zeros à esquerda caem
+    # ('001' -> '1'), como quando o pandas a lia como números; ao lado de
+    # valores como 'A-01' o número fica como foi escrito
+    digitos = numero[val_id.notna()].str.fullmatch(r'\d+')
+    if len(digitos) and digitos.all():
+        numero = numero.str.lstrip('0').replace('', '0')
+    numero = numero.where(val_id.notna(), '')
+
+    hoje = datetime.now().date()
+    if 'data_final' in df.columns:
+        datas = converter_datas(df['data_final'])
+        data_final = datas.where(datas.notna(), hoje)
+    else:
+        data_final = pd.Series(hoje, index=df.index, dtype='object')
+
+    booleanos = {}
+    for colunas in MAPA_IMPORTACAO.values():
+        for lista in colunas.values():
+            for nome in lista:
+                if nome not in booleanos:
+                    booleanos[nome] = converter_booleano_coluna(_coluna(df, nome))
+
+    grupos = {}
+    for grupo, chaves in MAPA_IMPORTACAO.items():
+        grupos[grupo] = pd.DataFrame({
+            chave: pd.concat([booleanos[n] for n in lista], axis=1).any(axis=1)
+            for chave, lista in chaves.items()
+        }, index=df.index)
+
+    tipo_enc = _coluna(df, 'enc_tipo').astype(str).str.lower().where(_coluna(df, 'enc_tipo').notna(), '')
+    sem_encadernacao = grupos['estado_conservacao']['sem_encadernacao']
+    eh_encadernada = tipo_enc.str.contains('|'.join(TIPOS_ENCADERNADA), regex=True) & ~sem_encadernacao
+    estado = grupos['estado_conservacao']
+    estado.insert(0, 'encadernada', eh_encadernada)
+    estado.insert(2, 'inteira', tipo_enc.str.contains('inteira', regex=False))
+    estado.insert(3, 'meia_com_cantos', tipo_enc.str.contains('meia', regex=False) & tipo_enc.str.contains('cantos', regex=False))
+
+    caminho = _coluna(df, 'Imagem 1')
+    caminho = caminho.where(caminho.notna(), _coluna(df, 'foto_path'))
+    caminho = caminho.astype(str).str.strip().where(caminho.notna(), '')
+    caminho = caminho.where(caminho.str.lower() != 'nan', '')
+
+    normalizado = pd.DataFrame({
+        'numero_ficha': numero,
+        'avaliacao': converter_avaliacao_coluna(_coluna(df, 'estado_geral')),
+        'autor': _valor_ou_none(_coluna(df, 'autor')),
+        'titulo': _valor_ou_none(_coluna(df, 'titulo')),
+        'registro': _texto_coluna(_coluna(df, 'registro'), remover_decimal=True),
+        'n_chamada': _texto_coluna(_coluna(df, 'num_chamada'), remover_decimal=True),
+        'secao_guarda': _valor_ou_none(_coluna(df, 'secao_guarda')),
+        'data_obra': _texto_coluna(_coluna(df, 'data_obra')),
+        'paginas': _texto_coluna(_coluna(df, 'num_paginas'), remover_decimal=True),
+        'dimensoes': _texto_coluna(_coluna(df, 'dimensoes')),
+        'observacoes': _valor_ou_none(_coluna(df, 'observacoes')),
+        'tecnico_nome': _valor_ou_none(_coluna(df, 'tecnico')),
+        'data_preenchimento': data_final,
+        'caminho_imagem': caminho,
+    }, index=df.index)
+
+    for grupo, tabela in grupos.items():
+        registros = tabela.to_dict(orient='records')
+        if grupo == 'especificacao_material':
+            for r in registros:
+                r['outro_texto'] = ''
+        normalizado[grupo] = registros
+
+    return normalizado
+
+
+def diagnosticar_dataframe(df):
+    """(colunas desconhecidas, números de ficha, problemas por linha) de um bloco da planilha.
+
+    Usa a mesma normalização da importação e não consulta o banco: números
+    repetidos entre blocos e fichas já cadastradas ficam com validar_blocos.
+    """
+    df = df.copy()
+    df.columns = df.columns.str.strip()
+    normalizado = normalizar_dataframe(df)
+    numero = normalizado['numero_ficha']
+    ocorrencias = []
+
+    def registrar(mascara, problema, coluna, valores):
+        if mascara.any():
+            ocorrencias.append(pd.DataFrame({'problema': problema, 'coluna': coluna,
+                                             'valor': valores[mascara].astype(str)}))
+
+    coluna_numero = 'id' if 'id' in df.columns else 'numero_ficha'
+    registrar(numero.isin(['', 'nan']), 'sem_numero', coluna_numero, numero)
+
+    if 'data_final' in df.columns:
+        bruto = df['data_final']
+        preenchida = bruto.notna() & (bruto.astype(str).str.strip() != '')
+        registrar(preenchida & converter_datas(bruto).isna(), 'data_invalida', 'data_final', bruto)
+
+    if 'estado_geral' in df.columns:
+        bruto = df['estado_geral']
+        texto = bruto.astype(str).str.strip().str.lower()
+        registrar(bruto.notna() & ~texto.isin(VALORES_AVALIACAO + ['']), 'avaliacao_invalida', 'estado_geral', bruto)
+
+    for nome in COLUNAS_MARCACAO:
+        if nome not in df.columns or pd.api.types.is_bool_dtype(df[nome]):
+            continue
+        # poucos valores distintos por coluna: confere cada um uma vez só
+        bruto = df[nome]
+        distintos = pd.Series(bruto.dropna().unique())
+        texto = distintos.astype(str).str.strip().str.lower()
+        numerico = pd.to_numeric(texto.str.replace(',', '.', regex=False), errors='coerce').notna()
+        invalidos = distintos[~(numerico | texto.isin(VALORES_VERDADEIROS) | texto.isin(VALORES_FALSOS))]
+        registrar(bruto.isin(invalidos), 'marcacao_invalida', nome, bruto)
+
+    limites = [(campo, origem, Ficha.__table__.c[campo].type.length) for campo, origem in CAMPOS_TEXTO.items()]
+    limites.append(('caminho_imagem', 'Imagem 1', Imagem.__table__.c.caminho.type.length))
+    for campo, origem, limite in limites:
+        tamanhos = normalizado[campo].astype(str).str.len().where(normalizado[campo].notna(), 0)
+        registrar(tamanhos > limite, 'texto_longo', coluna_numero if campo == 'numero_ficha' else origem,
+                  tamanhos.astype(str) + f' caracteres (máximo {limite})')
+
+    desconhecidas = [coluna for coluna in df.columns if coluna not in COLUNAS_CONHECIDAS]
+    problemas = pd.concat(ocorrencias) if ocorrencias else pd.DataFrame(columns=['problema', 'coluna', 'valor'])
+    return desconhecidas, numero, problemas
+
+
+def _gravar_lote(lote):
+    numeros = lote['numero_ficha'].tolist()
+    existentes = {n for (n,) in db.session.query(Ficha.numero_ficha).filter(Ficha.numero_ficha.in_(numeros))}
+    novas = lote[~lote['numero_ficha'].isin(existentes)]
+    if novas.empty:
+        return 0
+
+    caminhos = dict(zip(novas['numero_ficha'], novas['caminho_imagem']))
+    valores = novas.drop(columns=['caminho_imagem']).to_dict(orient='records')
+    numerar(valores)
+    for linha in valores:
+        separar_outros(linha)
+
+    # ON CONFLICT cobre fichas gravadas por outra requisição entre a consulta e o insert
+    stmt = (insert_dialeto(Ficha).values(valores)
+            .on_conflict_do_nothing(index_elements=['numero_ficha'])
+            .returning(Ficha.id, Ficha.numero_ficha))
+    inseridas = db.session.execute(stmt).all()
+
+    imagens = [{'ficha_id': id_ficha, 'caminho': caminhos[numero]}
+               for id_ficha, numero in inseridas if caminhos.get(numero)]
+    if imagens:
+        db.session.execute(insert_dialeto(Imagem).values(imagens))
+
+    numeros_inseridos = {numero for _, numero in inseridas}
+    registrar_lote(v for v in valores if v['numero_ficha'] in numeros_inseridos)
+
+    return len(inseridas)
+
+
+def detectar_delimitador(arquivo):
+    inicio = arquivo.tell()
+    amostra = arquivo.read(AMOSTRA_DELIMITADOR)
+    arquivo.seek(inicio)
+    if isinstance(amostra, bytes):
+        amostra = amostra.decode('utf-8', errors='ignore')
+    # só linhas inteiras: a última pode ter sido cortada no meio
+    if '\n' in amostra:
+        amostra = amostra[:amostra.rindex('\n')]
+    try:
+        return csv.Sniffer().sniff(amostra, delimiters=DELIMITADORES).delimiter
+    except csv.Error:
+        return ','
+
+
+def _blocos_csv(arquivo, tamanho_bloco):
+    # engine C com o delimitador já conhecido; tudo como texto para que o
+    # tipo de uma coluna não mude de um bloco para outro
+    leitor = pd.read_csv(arquivo, sep=detectar_delimitador(arquivo), engine='c',
+                         dtype=str, chunksize=tamanho_bloco)
+    with leitor:
+        yield from leitor
+
+
+def _blocos_xlsx(arquivo, tamanho_bloco):
+    from openpyxl import load_workbook
+
+    livro = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = livro.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = [str(nome) if nome is not None else f'Unnamed: {i}' for i, nome in enumerate(cabecalho)]
+        largura = len(colunas)
+        # o índice conta as linhas vazias, como o do read_csv conta as do
+        # arquivo: linha da planilha = índice + 2 nos dois formatos
+        numeradas = enumerate(linhas)
+        while True:
+            lidas = list(itertools.islice(numeradas, tamanho_bloco))
+            if not lidas:
+                return
+            # linhas completamente vazias não chegam ao DataFrame, como no read_excel
+            bloco = [(i, linha[:largura] + (None,) * (largura - len(linha)))
+                     for i, linha in lidas if any(valor is not None for valor in linha)]
+            if bloco:
+                yield pd.DataFrame.from_records([linha for _, linha in bloco], columns=colunas,
+                                                index=pd.Index([i for i, _ in bloco]))
+    finally:
+        livro.close()
+
+
+def ler_blocos(arquivo, nome_arquivo, tamanho_bloco=TAMANHO_BLOCO_PADRAO):
+    """DataFrames de até tamanho_bloco linhas, lidos sem carregar a planilha inteira."""
+    # caminho (tarefas) ou o arquivo enviado na requisição
+    proprio = isinstance(arquivo, str)
+    if proprio:
+        arquivo = open(arquivo, 'rb')
+    try:
+        nome = nome_arquivo.lower()
+        if nome.endswith('.csv'):
+            yield from _blocos_csv(arquivo, tamanho_bloco)
+        elif nome.endswith('.xls'):
+            # formato antigo, que o openpyxl não lê: vai inteiro pelo pandas
+            yield pd.read_excel(arquivo)
+        else:
+            yield from _blocos_xlsx(arquivo, tamanho_bloco)
+    finally:
+        if proprio:
+            arquivo.close()
+
+
+def _processar_blocos(blocos, processos, funcao=normalizar_dataframe):
+    blocos = iter(blocos)
+    inicio = list(itertools.islice(blocos, 2))
+    # um bloco só (planilhas pequenas) ou sem fork: processa aqui mesmo
+    if processos <= 1 or len(inicio) < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+        for bloco in itertools.chain(inicio, blocos):
+            yield funcao(bloco)
+        return
+
+    # fork: os filhos herdam o código já importado sem reimportar o app (o
+    # que abriria conexões com o banco); funcao não pode usar o banco.
+    # No máximo 2 blocos por processo em andamento, para a memória não
+    # crescer com o tamanho do arquivo; os resultados saem na ordem do arquivo.
+    with ProcessPoolExecutor(processos, mp_context=multiprocessing.get_context('fork')) as pool:
+        pendentes = deque()
+        for bloco in itertools.chain(inicio, blocos):
+            pendentes.append(pool.submit(funcao, bloco))
+            if len(pendentes) >= processos * 2:
+                yield pendentes.popleft().result()
+        while pendentes:
+            yield pendentes.popleft().result()
+
+
+def importar_blocos(blocos, tamanho_lote=TAMANHO_LOTE_PADRAO, progresso=None, processos=1):
+    total = 0
+    processadas = 0
+    ignoradas_arquivo = 0
+    relatorio = []
+    for normalizado in _processar_blocos(blocos, processos):
+        total += len(normalizado)
+        validas = normalizado[(normalizado['numero_ficha'] != '') & (normalizado['numero_ficha'] != 'nan')]
+        # repetições dentro do bloco caem aqui; as de blocos anteriores já
+        # estão gravadas e são ignoradas por _gravar_lote
+        validas = validas.drop_duplicates(subset='numero_ficha', keep='first')
+        ignoradas_arquivo += len(normalizado) - len(validas)
+
+        for inicio in range(0, len(validas), tamanho_lote):
+            lote = validas.iloc[inicio:inicio + tamanho_lote]
+            try:
+                inseridas = _gravar_lote(lote)
+                db.session.commit()
+                relatorio.append({'lote': len(relatorio) + 1, 'inseridas': inseridas,
+                                  'ignoradas': len(lote) - inseridas, 'falhas': 0})
+            except Exception as e:
+                db.session.rollback()
+                print(f"ERRO IMPORTACAO (lote {len(relatorio) + 1}): {e}")
+                relatorio.append({'lote': len(relatorio) + 1, 'inseridas': 0,
+                                  'ignoradas': 0, 'falhas': len(lote), 'erro': str(e)})
+            processadas += len(lote)
+            if progresso:
+                progresso(processadas, relatorio[-1])
+
+    return {
+        'total_linhas': total,
+        'inseridas': sum(r['inseridas'] for r in relatorio),
+        'ignoradas': ignoradas_arquivo + sum(r['ignoradas'] for r in relatorio),
+        'falhas': sum(r['falhas'] for r in relatorio),
+        'lotes': relatorio,
+    }
+
+
+def importar_arquivo(arquivo, nome_arquivo, tamanho_lote=TAMANHO_LOTE_PADRAO, progresso=None,
+                     processos=1, tamanho_bloco=TAMANHO_BLOCO_PADRAO):
+    return importar_blocos(ler_blocos(arquivo, nome_arquivo, tamanho_bloco), tamanho_lote, progresso, processos)
+
+
+def _ja_cadastradas(numeros):
+    existentes = set()
+    for inicio in range(0, len(numeros), TAMANHO_LOTE_PADRAO):
+        existentes.update(n for (n,) in db.session.query(Ficha.numero_ficha)
+                          .filter(Ficha.numero_ficha.in_(numeros[inicio:inicio + TAMANHO_LOTE_PADRAO])))
+    return existentes
+
+
+def validar_blocos(blocos, saida=None, processos=1, progresso=None):
+    """Confere a planilha sem gravar nada e devolve o resumo dos problemas.
+
+    Cada problema encontrado vira uma linha CSV em 'saida' (arquivo de texto
+    aberto pelo chamador), com a linha da planilha em que aparece; o resumo
+    traz as contagens por tipo e as primeiras ocorrências.
+    """
+    escritor = None
+    if saida is not None:
+        escritor = csv.writer(saida)
+        escritor.writerow(COLUNAS_RELATORIO)
+    amostra = []
+
+    def anotar(linhas):
+        if escritor:
+            escritor.writerows(linhas)
+        faltam = LIMITE_AMOSTRA_VALIDACAO - len(amostra)
+        amostra.extend(dict(zip(COLUNAS_RELATORIO, linha)) for linha in linhas[:max(faltam, 0)])
+
+    # número -> linha da primeira ocorrência no arquivo
+    vistos = {}
+    contagem = Counter()
+    desconhecidas = None
+    total = a_importar = com_problema = 0
+    for colunas, numero, problemas in _processar_blocos(blocos, processos, diagnosticar_dataframe):
+        if desconhecidas is None:
+            desconhecidas = colunas
+            contagem['coluna_desconhecida'] += len(colunas)
+            anotar([['', '', 'coluna_desconhecida', coluna, '', PROBLEMAS['coluna_desconhecida']]
+                    for coluna in colunas])
+        total += len(numero)
+
+        validos = numero[~numero.isin(['', 'nan'])]
+        linhas = pd.Series(validos.index + 2, index=validos.index)
+        primeira = validos.map(vistos)
+        novos = validos[primeira.isna()]
+        unicos = novos[~novos.duplicated()]
+        primeira = primeira.fillna(novos.map(pd.Series(unicos.index + 2, index=unicos.values)))
+        repetidas = primeira != linhas
+        vistos.update(zip(unicos.tolist(), (unicos.index + 2).tolist()))
+        cadastradas = unicos.isin(_ja_cadastradas(unicos.tolist()))
+        a_importar += len(unicos) - int(cadastradas.sum())
+
+        partes = [problemas, pd.DataFrame({
+            'problema': 'duplicada_no_arquivo', 'coluna': 'numero_ficha',
+            'valor': 'primeira ocorrência na linha ' + primeira[repetidas].astype(int).astype(str),
+        }), pd.DataFrame({'problema': 'ja_cadastrada', 'coluna': 'numero_ficha', 'valor': unicos[cadastradas]})]
+        partes = [parte for parte in partes if not parte.empty]
+        if partes:
+            todos = pd.concat(partes).sort_index(kind='stable')
+            com_problema += todos.index.nunique()
+            contagem.update(todos['problema'].value_counts().to_dict())
+            anotar(pd.DataFrame({
+                'linha': todos.index + 2,
+                'numero_ficha': numero.reindex(todos.index).values,
+                'problema': todos['problema'].values,
+                'coluna': todos['coluna'].values,
+                'valor': todos['valor'].values,
+                'descricao': todos['problema'].map(PROBLEMAS).values,
+            }).values.tolist())
+        if progresso:
+            progresso(total)
+
+    # só leitura: encerra a transação aberta pelas consultas de números
+    db.session.rollback()
+    return {
+        'total_linhas': total,
+        'a_importar': a_importar,
+        'linhas_com_problema': com_problema,
+        'colunas_desconhecidas': desconhecidas or [],
+        'problemas': {problema: contagem[problema] for problema in PROBLEMAS if contagem[problema]},
+        'amostra': amostra,
+    }
+
+
+def validar_arquivo(arquivo, nome_arquivo, saida=None, processos=1, tamanho_bloco=TAMANHO_BLOCO_PADRAO,
+                    progresso=None):
+    return validar_blocos(ler_blocos(arquivo, nome_arquivo, tamanho_bloco), saida, processos, progresso)
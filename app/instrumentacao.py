@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .models import db
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 500)
+JANELA_RECENTE = 1000
+
+
+@contextmanager
+def contar_consultas():
+    """Registra os comandos SQL executados dentro do bloco.
+
+    Uso em testes:
+        with contar_consultas() as consultas:
+            client.get('/exportar')
+        assert len(consultas) == 3
+    """
+    consultas = []
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        consultas.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', registrar)
+    try:
+        yield consultas
+    finally:
+        event.remove(engine, 'before_cursor_execute', registrar)
+
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.contagens = [0] * len(buckets)
+        self.soma = 0.0
+        self.total = 0
+        # janela das últimas observações, para percentis recentes
+        self.recentes = deque(maxlen=JANELA_RECENTE)
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[i] += 1
+        self.soma += valor
+        self.total += 1
+        self.recentes.append(valor)
+
+    def percentil(self, p):
+        if not self.recentes:
+            return None
+        ordenados = sorted(self.recentes)
+        return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requisicoes = defaultdict(int)  # (rota, metodo, status) -> total
+        self.latencia = defaultdict(lambda: Histograma(BUCKETS_LATENCIA))
+        self.consultas = defaultdict(lambda: Histograma(BUCKETS_CONSULTAS))
+        self.tempo_sql = defaultdict(float)
+        self.linhas = defaultdict(int)
+        self.sql_lentas = 0
+
+    def registrar(self, rota, metodo, status, duracao, consultas, tempo_sql, linhas):
+        with self._lock:
+            self.requisicoes[(rota, metodo, status)] += 1
+            self.latencia[rota].observar(duracao)
+            self.consultas[rota].observar(consultas)
+            self.tempo_sql[rota] += tempo_sql
+            self.linhas[rota] += linhas
+
+    def registrar_sql_lenta(self):
+        with self._lock:
+            self.sql_lentas += 1
+
+    def resumo(self):
+        with self._lock:
+            return {
+                rota: {
+                    'requisicoes': hist.total,
+                    'latencia_p50_ms': _ms(hist.percentil(0.5)),
+                    'latencia_p95_ms': _ms(hist.percentil(0.95)),
+                    'consultas_media': round(self.consultas[rota].soma / hist.total, 1) if hist.total else 0,
+                    'tempo_sql_ms': _ms(self.tempo_sql[rota]),
+                    'linhas_lidas': self.linhas[rota],
+                }
+                for rota, hist in self.latencia.items()
+            }
+
+
+def _ms(segundos):
+    return round(segundos * 1000, 1) if segundos is not None else None
+
+
+registro = Registro()
+# métricas da requisição em andamento nesta thread; fica ativa até a resposta
+# ser fechada, inclusive durante a geração de respostas em streaming
+_atual = threading.local()
+limites = {'sql_lento_ms': 200, 'requisicao_lenta_ms': 1000}
+_logger = None
+
+
+# o início fica no contexto de execução do comando: se ele falhar,
+# after_cursor_execute não dispara e nada sobra na conexão
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    context._inicio_sql = time.perf_counter()
+
+
+def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+    duracao = time.perf_counter() - context._inicio_sql
+
+    if duracao * 1000 >= limites['sql_lento_ms']:
+        registro.registrar_sql_lenta()
+        rota = request.path if has_request_context() else '-'
+        _logger.warning("SQL lenta (%.0f ms) em %s: %s", duracao * 1000, rota, statement[:500])
+
+    metricas = getattr(_atual, 'metricas', None)
+    if metricas is not None:
+        metricas['consultas'] += 1
+        metricas['tempo_sql'] += duracao
+        # nem todo driver informa rowcount de SELECT (-1 nesses casos)
+        if statement.lstrip()[:6].upper() == 'SELECT' and cursor.rowcount and cursor.rowcount > 0:
+            metricas['linhas'] += cursor.rowcount
+
+
+def _inicio_requisicao():
+    _atual.metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'tempo_sql': 0.0, 'linhas': 0}
+
+
+def _resposta(resposta):
+    metricas = getattr(_atual, 'metricas', None)
+    if metricas is None:
+        return resposta
+    metricas['status'] = resposta.status_code
+    metricas['rota'] = request.url_rule.rule if request.url_rule else 'nao_encontrada'
+    metricas['metodo'] = request.method
+    metricas['caminho'] = request.path
+    # registra só quando a resposta é fechada: em respostas em streaming
+    # (/exportar) as consultas feitas pelo gerador também entram na conta
+    resposta.call_on_close(lambda: _finalizar(metricas))
+    return resposta
+
+
+def _finalizar(metricas):
+    if getattr(_atual, 'metricas', None) is metricas:
+        _atual.metricas = None
+    duracao = time.perf_counter() - metricas['inicio']
+    registro.registrar(metricas['rota'], metricas['metodo'], metricas['status'], duracao,
+                       metricas['consultas'], metricas['tempo_sql'], metricas['linhas'])
+
+    if duracao * 1000 >= limites['requisicao_lenta_ms']:
+        _logger.warning("Requisição lenta: %s %s %.0f ms, %d consultas (%.0f ms em SQL)",
+                        metricas['metodo'], metricas['caminho'], duracao * 1000,
+                        metricas['consultas'], metricas['tempo_sql'] * 1000)
+
+
+def instalar(app):
+    global _logger
+    _logger = app.logger
+    limites['sql_lento_ms'] = app.config['INSTRUMENTACAO_SQL_LENTO_MS']
+    limites['requisicao_lenta_ms'] = app.config['INSTRUMENTACAO_REQUISICAO_LENTA_MS']
+    # os eventos valem para qualquer Engine: registra uma vez só, mesmo com vários apps
+    if not event.contains(Engine, 'before_cursor_execute', _antes_sql):
+        event.listen(Engine, 'before_cursor_execute', _antes_sql)
+        event.listen(Engine, 'after_cursor_execute', _depois_sql)
+    app.before_request(_inicio_requisicao)
+    app.after_request(_resposta)
+
+
+def _rotulos(**valores):
+    return ','.join(f'{k}="{str(v)}"' for k, v in valores.items())
+
+
+def _histograma_prometheus(nome, hist, rota):
+    linhas = []
+    for limite, total in zip(hist.buckets, hist.contagens):
+        linhas.append(f'{nome}_bucket{{{_rotulos(rota=rota, le=limite)}}} {total}')
+    linhas.append(f'{nome}_bucket{{{_rotulos(rota=rota, le="+Inf")}}} {hist.total}')
+    linhas.append(f'{nome}_sum{{{_rotulos(rota=rota)}}} {hist.soma}')
+    linhas.append(f'{nome}_count{{{_rotulos(rota=rota)}}} {hist.total}')
+    return linhas
+
+
+def exportar_prometheus(extras=None):
+    linhas = []
+    with registro._lock:
+        linhas += ['# HELP http_requisicoes_total Requisições atendidas.',
+                   '# TYPE http_requisicoes_total counter']
+        for (rota, metodo, status), total in sorted(registro.requisicoes.items()):
+            linhas.append(f'http_requisicoes_total{{{_rotulos(rota=rota, metodo=metodo, status=status)}}} {total}')
+
+        linhas += ['# HELP http_latencia_segundos Latência total por rota.',
+                   '# TYPE http_latencia_segundos histogram']
+        for rota, hist in sorted(registro.latencia.items()):
+            linhas += _histograma_prometheus('http_latencia_segundos', hist, rota)
+
+        linhas += ['# HELP sql_consultas_por_requisicao Comandos SQL por requisição.',
+                   '# TYPE sql_consultas_por_requisicao histogram']
+        for rota, hist in sorted(registro.consultas.items()):
+            linhas += _histograma_prometheus('sql_consultas_por_requisicao', hist, rota)
+
+        linhas += ['# HELP sql_tempo_segundos_total Tempo gasto em SQL por rota.',
+                   '# TYPE sql_tempo_segundos_total counter']
+        for rota, total in sorted(registro.tempo_sql.items()):
+            linhas.append(f'sql_tempo_segundos_total{{{_rotulos(rota=rota)}}} {total}')
+
+        linhas += ['# HELP sql_linhas_lidas_total Linhas retornadas por SELECT (quando o driver informa).',
+                   '# TYPE sql_linhas_lidas_total counter']
+        for rota, total in sorted(registro.linhas.items()):
+            linhas.append(f'sql_linhas_lidas_total{{{_rotulos(rota=rota)}}} {total}')
+
+        linhas += ['# HELP sql_lentas_total Comandos SQL acima do limite configurado.',
+                   '# TYPE sql_lentas_total counter',
+                   f'sql_lentas_total {registro.sql_lentas}']
+
+    for nome, valor in (extras or {}).items():
+        linhas += [f'# TYPE {nome} gauge', f'{nome} {valor}']
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,179 @@
+import json
+from collections import Counter, defaultdict
+from .models import db
+from .vocabulario import GRUPOS, MODOS, POSICOES, codificar, decodificar
+
+TAMANHO_LOTE_MIGRACAO = 1000
+
+
+def modo_no_banco():
+    """'jsonb' ou 'bits', conforme o que está gravado hoje; None se não der para saber."""
+    if db.engine.dialect.name == 'postgresql':
+        for coluna in db.inspect(db.engine).get_columns('fichas'):
+            if coluna['name'] == GRUPOS[0]:
+                return 'bits' if 'INT' in str(coluna['type']).upper() else 'jsonb'
+        return None
+    valor = db.session.execute(db.text(
+        f"SELECT {GRUPOS[0]} FROM fichas WHERE {GRUPOS[0]} IS NOT NULL LIMIT 1")).scalar()
+    if valor is None:
+        return None
+    return 'bits' if isinstance(valor, int) else 'jsonb'
+
+
+def _tamanho_tabela():
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    return db.session.execute(db.text("SELECT pg_total_relation_size('fichas')")).scalar()
+
+
+def _json(valor):
+    if valor is None or isinstance(valor, dict):
+        return valor
+    return json.loads(valor)
+
+
+# --- PostgreSQL: conversão da coluna no próprio banco (ALTER ... USING) ---
+
+def _desconhecidas_postgres():
+    consultas = [
+        f"""SELECT '{grupo}', e.key, count(*) FROM fichas, jsonb_each({grupo}) AS e
+            WHERE e.value = 'true'::jsonb AND e.key NOT IN ({', '.join(f"'{c}'" for c in POSICOES[grupo])})
+            GROUP BY e.key"""
+        for grupo in GRUPOS
+    ]
+    desconhecidas = defaultdict(dict)
+    for grupo, chave, total in db.session.execute(db.text(' UNION ALL '.join(consultas))):
+        desconhecidas[grupo][chave] = total
+    return dict(desconhecidas)
+
+
+def _para_bits_postgres():
+    outros = ', '.join(f"'{g}', nullif({g}->>'outro_texto', '')" for g in GRUPOS)
+    com_outro = ' OR '.join(f"coalesce({g}->>'outro_texto', '') <> ''" for g in GRUPOS)
+    comandos = [
+        f"""UPDATE fichas SET outros_textos = nullif(jsonb_strip_nulls(jsonb_build_object({outros})), '{{}}'::jsonb)
+            WHERE {com_outro}""",
+    ]
+    for grupo in GRUPOS:
+        bits = ' | '.join(f"""(CASE WHEN {grupo} @> '{{"{chave}": true}}' THEN {1 << posicao} ELSE 0 END)"""
+                          for chave, posicao in POSICOES[grupo].items())
+        comandos += [
+            f"DROP INDEX IF EXISTS ix_fichas_{grupo}_gin",
+            f"ALTER TABLE fichas ALTER COLUMN {grupo} TYPE integer USING (CASE WHEN {grupo} IS NULL THEN NULL ELSE {bits} END)",
+        ]
+    return comandos
+
+
+def _para_jsonb_postgres():
+    comandos = []
+    for grupo in GRUPOS:
+        pares = ', '.join(f"'{chave}', ({grupo} & {1 << posicao}) <> 0" for chave, posicao in POSICOES[grupo].items())
+        outro = (f"CASE WHEN outros_textos ? '{grupo}' "
+                 f"THEN jsonb_build_object('outro_texto', outros_textos->>'{grupo}') ELSE '{{}}'::jsonb END")
+        comandos += [
+            f"ALTER TABLE fichas ALTER COLUMN {grupo} TYPE jsonb USING "
+            f"(CASE WHEN {grupo} IS NULL THEN NULL ELSE jsonb_build_object({pares}) || {outro} END)",
+            f"CREATE INDEX IF NOT EXISTS ix_fichas_{grupo}_gin ON fichas USING gin ({grupo} jsonb_path_ops)",
+        ]
+    comandos.append("UPDATE fichas SET outros_textos = NULL WHERE outros_textos IS NOT NULL")
+    return comandos
+
+
+# --- demais bancos (SQLite): conversão linha a linha no Python ---
+
+def _lotes():
+    ultimo = 0
+    colunas = ', '.join(GRUPOS)
+    while True:
+        linhas = db.session.execute(db.text(
+            f"SELECT id, {colunas}, outros_textos FROM fichas WHERE id > :ultimo ORDER BY id LIMIT :limite"),
+            {'ultimo': ultimo, 'limite': TAMANHO_LOTE_MIGRACAO}).all()
+        if not linhas:
+            return
+        yield linhas
+        ultimo = linhas[-1][0]
+
+
+def _desconhecidas_python():
+    desconhecidas = defaultdict(Counter)
+    for linhas in _lotes():
+        for linha in linhas:
+            for grupo, valor in zip(GRUPOS, linha[1:]):
+                for chave, marcado in (_json(valor) or {}).items():
+                    if marcado is True and chave not in POSICOES[grupo]:
+                        desconhecidas[grupo][chave] += 1
+    return {grupo: dict(chaves) for grupo, chaves in desconhecidas.items()}
+
+
+def _converter_linha(linha, destino):
+    novos = {'id': linha[0]}
+    if destino == 'bits':
+        outros = {}
+        for grupo, valor in zip(GRUPOS, linha[1:]):
+            dados = _json(valor)
+            novos[grupo] = None if dados is None else codificar(grupo, dados)
+            if dados and dados.get('outro_texto'):
+                outros[grupo] = dados['outro_texto']
+        novos['outros_textos'] = json.dumps(outros, ensure_ascii=False) if outros else None
+    else:
+        outros = _json(linha[-1]) or {}
+        for grupo, valor in zip(GRUPOS, linha[1:]):
+            if valor is None:
+                novos[grupo] = None
+                continue
+            dados = decodificar(grupo, int(valor))
+            if outros.get(grupo):
+                dados['outro_texto'] = outros[grupo]
+            novos[grupo] = json.dumps(dados, ensure_ascii=False)
+        novos['outros_textos'] = None
+    return novos
+
+
+def _converter_python(destino):
+    atribuicoes = ', '.join(f"{coluna} = :{coluna}" for coluna in GRUPOS + ['outros_textos'])
+    comando = db.text(f"UPDATE fichas SET {atribuicoes} WHERE id = :id")
+    for linhas in _lotes():
+        db.session.execute(comando, [_converter_linha(linha, destino) for linha in linhas])
+
+
+def converter_marcacoes(destino, descartar_desconhecidas=False):
+    """Converte os grupos de checkbox de todas as fichas para o modo 'destino'.
+
+    Chaves marcadas que não estão no vocabulário não têm bit: a conversão
+    para 'bits' é recusada se existirem, a menos que descartar_desconhecidas.
+    """
+    if destino not in MODOS:
+        raise ValueError(f"modo inválido: {destino}")
+    atual = modo_no_banco()
+    if atual == destino:
+        return {'modo': destino, 'convertido': False}
+
+    postgres = db.engine.dialect.name == 'postgresql'
+    desconhecidas = {}
+    if destino == 'bits':
+        desconhecidas = _desconhecidas_postgres() if postgres else _desconhecidas_python()
+        if desconhecidas and not descartar_desconhecidas:
+            raise ValueError(f"chaves fora do vocabulário: {desconhecidas}")
+
+    tamanho_antes = _tamanho_tabela()
+    try:
+        if postgres:
+            for comando in (_para_bits_postgres() if destino == 'bits' else _para_jsonb_postgres()):
+                db.session.execute(db.text(comando))
+        else:
+            _converter_python(destino)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if postgres:
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(db.text("ANALYZE fichas"))
+
+    return {
+        'modo': destino,
+        'convertido': True,
+        'chaves_descartadas': desconhecidas,
+        'tamanho_antes_bytes': tamanho_antes,
+        'tamanho_depois_bytes': _tamanho_tabela(),
+    }
@@ -1,10 +1,47 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import selectinload, joinedload
+from . import vocabulario
+from .vocabulario import tipo_coluna
 
 db = SQLAlchemy()
 
+GRUPOS_CHECKBOX = vocabulario.GRUPOS
+
+SEQUENCIA_ALTERACOES = 'fichas'
+
+
+def reservar_sequencia(conexao, quantidade=1):
+    """Reserva 'quantidade' números da sequência de alterações; devolve o último.
+
+    O contador é uma linha atualizada na própria transação da gravação: ela
+    fica bloqueada até o commit, então a ordem da sequência é a ordem em que
+    as alterações ficam visíveis (um sincronizador nunca pula uma alteração
+    que ainda não tinha sido confirmada).
+    """
+    stmt = insert_dialeto(Contador).values(nome=SEQUENCIA_ALTERACOES, valor=quantidade)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['nome'],
+        set_={'valor': Contador.valor + stmt.excluded.valor}
+    ).returning(Contador.valor)
+    return conexao.execute(stmt).scalar()
+
+
+def _proxima_alteracao(contexto):
+    return reservar_sequencia(contexto.connection)
+
+
 class Ficha(db.Model):
     __tablename__ = 'fichas'
+    # GIN com jsonb_path_ops atende consultas de contenção (@>) nos grupos de
+    # checkbox; no modo 'bits' os grupos são inteiros e não há índice
+    __table_args__ = tuple(
+        db.Index(f'ix_fichas_{grupo}_gin', grupo,
+                 postgresql_using='gin', postgresql_ops={grupo: 'jsonb_path_ops'})
+        for grupo in GRUPOS_CHECKBOX
+    ) if vocabulario.MODO == 'jsonb' else ()
 
     id = db.Column(db.Integer, primary_key=True)
     numero_ficha = db.Column(db.String(50), unique=True)
@@ -19,19 +56,42 @@ class Ficha(db.Model):
     paginas = db.Column(db.String(50))
     dimensoes = db.Column(db.String(100))
 
-    especificacao_material = db.Column(JSONB) 
-    tipo_suporte = db.Column(JSONB)
-    estado_conservacao = db.Column(JSONB)
-    deterioracoes = db.Column(JSONB)
+    especificacao_material = db.Column(tipo_coluna('especificacao_material', JSONB))
+    tipo_suporte = db.Column(tipo_coluna('tipo_suporte', JSONB))
+    estado_conservacao = db.Column(tipo_coluna('estado_conservacao', JSONB))
+    deterioracoes = db.Column(tipo_coluna('deterioracoes', JSONB))
     
-    tratamento_planos = db.Column(JSONB)
-    tratamento_volumes = db.Column(JSONB)
+    tratamento_planos = db.Column(tipo_coluna('tratamento_planos', JSONB))
+    tratamento_volumes = db.Column(tipo_coluna('tratamento_volumes', JSONB))
+    # {grupo: texto de "Outro"}; só usado no modo 'bits'
+    outros_textos = db.Column(JSONB)
 
     observacoes = db.Column(db.Text)
     tecnico_nome = db.Column(db.String(150))
     data_preenchimento = db.Column(db.Date)
 
-    imagens = db.relationship('Imagem', backref='ficha', cascade='all, delete-orphan')
+    # carimbo de versão: incrementado a cada gravação; compõe a chave do
+    # cache da página e o ETag de /ficha/<id>
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    atualizado_em = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now,
+                              server_default=db.func.now())
+    criado_em = db.Column(db.DateTime, default=datetime.now, server_default=db.func.now())
+    # sequência global de alterações (ver reservar_sequencia); base de /api/sincronizar
+    seq_alteracao = db.Column(db.BigInteger, index=True,
+                              default=_proxima_alteracao, onupdate=_proxima_alteracao)
+
+    imagens = db.relationship('Imagem', backref='ficha', cascade='all, delete-orphan', lazy='select')
+
+    def outro_texto(self, grupo):
+        return (self.outros_textos or {}).get(grupo) or (getattr(self, grupo) or {}).get('outro_texto', '')
+
+    def marcacoes(self, grupo):
+        # o grupo como dict, com o texto de "Outro" qualquer que seja o modo
+        dados = dict(getattr(self, grupo) or {})
+        outro = (self.outros_textos or {}).get(grupo)
+        if outro:
+            dados['outro_texto'] = outro
+        return dados
 
 
 class Imagem(db.Model):
@@ -39,9 +99,117 @@ class Imagem(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     
-    caminho = db.Column(db.String(255), nullable=False)
+    caminho = db.Column(db.String(255), nullable=False, index=True)
+    hash = db.Column(db.String(64), index=True)
+    largura = db.Column(db.Integer)
+    altura = db.Column(db.Integer)
+    tamanho_bytes = db.Column(db.BigInteger)
     
-    ficha_id = db.Column(db.Integer, db.ForeignKey('fichas.id'), nullable=False)
+    ficha_id = db.Column(db.Integer, db.ForeignKey('fichas.id'), nullable=False, index=True)
     
     def __repr__(self):
         return f'<Imagem {self.caminho}>'
+
+
+class Estatistica(db.Model):
+    __tablename__ = 'estatisticas'
+
+    # contadores agregados do acervo, ex.: ('avaliacao', '1'), ('deterioracoes', 'fungos')
+    dimensao = db.Column(db.String(50), primary_key=True)
+    chave = db.Column(db.String(200), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Contador(db.Model):
+    __tablename__ = 'contadores'
+
+    nome = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class FichaRemovida(db.Model):
+    __tablename__ = 'fichas_removidas'
+
+    # registro de exclusões para os sincronizadores; mesma sequência de Ficha.seq_alteracao
+    seq = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    ficha_id = db.Column(db.Integer, nullable=False)
+    numero_ficha = db.Column(db.String(50))
+    removida_em = db.Column(db.DateTime, default=datetime.now)
+
+
+class Tarefa(db.Model):
+    __tablename__ = 'tarefas'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)  # 'importacao', 'validacao', 'exportacao' ou 'armazenamento'
+    status = db.Column(db.String(20), nullable=False, default='pendente', index=True)
+    parametros = db.Column(JSONB)
+    arquivo_entrada = db.Column(db.String(255))
+    arquivo_saida = db.Column(db.String(255))
+    linhas_processadas = db.Column(db.Integer, nullable=False, default=0)
+    resultado = db.Column(JSONB)
+    erro = db.Column(db.Text)
+    criada_em = db.Column(db.DateTime, default=datetime.now)
+    iniciada_em = db.Column(db.DateTime)
+    batimento_em = db.Column(db.DateTime)
+    atualizada_em = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def para_dict(self):
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'status': self.status,
+            'linhas_processadas': self.linhas_processadas,
+            'resultado': self.resultado,
+            'erro': self.erro,
+            'criada_em': self.criada_em.isoformat() if self.criada_em else None,
+            'iniciada_em': self.iniciada_em.isoformat() if self.iniciada_em else None,
+            'atualizada_em': self.atualizada_em.isoformat() if self.atualizada_em else None,
+        }
+
+
+# Como carregar Ficha.imagens em cada tipo de consulta:
+#   'lote'     -> selectinload: um SELECT ... IN por lote de fichas (exportação, importação)
+#   'ficha'    -> joinedload: mesma consulta da ficha (visualização, exclusão)
+#   listagens não carregam Ficha: consultam só as colunas (consultas.COLUNAS_LISTAGEM)
+ESTRATEGIAS_IMAGENS = {
+    'lote': selectinload,
+    'ficha': joinedload,
+}
+
+def carregar_imagens(contexto):
+    return ESTRATEGIAS_IMAGENS[contexto](Ficha.imagens)
+
+
+def insert_dialeto(modelo):
+    # INSERT com suporte a ON CONFLICT / RETURNING no banco em uso
+    if db.engine.dialect.name == 'sqlite':
+        return sqlite.insert(modelo)
+    return postgresql.insert(modelo)
+
+
+def sincronizar_colunas():
+    # create_all não altera tabelas existentes: adiciona as colunas novas
+    # que ainda não existem no banco, preenchendo as linhas antigas com o
+    # server_default da coluna quando houver
+    inspetor = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for tabela in db.metadata.sorted_tables:
+            existentes = {c['name'] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name not in existentes:
+                    ddl = f'ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {coluna.type.compile(dialect=db.engine.dialect)}'
+                    padrao = coluna.server_default.arg if coluna.server_default is not None else None
+                    if isinstance(padrao, str):
+                        ddl += f" DEFAULT '{padrao}'"
+                    elif padrao is not None and db.engine.dialect.name != 'sqlite':
+                        # SQLite não aceita padrão não constante em ADD COLUMN
+                        ddl += f' DEFAULT {padrao.compile(dialect=db.engine.dialect)}'
+                    conn.execute(db.text(ddl))
+
+
+def criar_indices():
+    # create_all não cria índices em tabelas que já existem
+    for tabela in db.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(db.engine, checkfirst=True)
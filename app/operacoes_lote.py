@@ -0,0 +1,187 @@
+from collections import Counter
+from sqlalchemy import delete, func, select, update
+from werkzeug.datastructures import MultiDict
+from .models import db, Ficha, FichaRemovida, Imagem, GRUPOS_CHECKBOX, insert_dialeto, reservar_sequencia
+from .consultas import aplicar_filtros, ler_filtros, ler_inteiro
+from .estatisticas import COLUNAS_ESTATISTICA, ajustar, contribuicoes
+from .cache import paginas, invalidar_ficha
+from .imagens import agendar_remocao
+
+# ids por comando (IN (...)); todos os lotes entram na mesma transação
+TAMANHO_LOTE_OPERACOES = 1000
+# acima disso as páginas em cache são descartadas de uma vez, não ficha a ficha
+INVALIDAR_TUDO_ACIMA = 100
+
+CAMPOS_REATRIBUIVEIS = ('secao_guarda', 'tecnico_nome')
+# parâmetros aceitos em {'filtro': {...}}, os mesmos de /acervo
+CHAVES_FILTRO = ('titulo', 'autor', 'secao_guarda', 'avaliacao', 'data_inicio', 'data_fim')
+CHAVES_CONDICAO = tuple(GRUPOS_CHECKBOX) + tuple(f'sem_{grupo}' for grupo in GRUPOS_CHECKBOX)
+
+
+def selecionar(dados):
+    """Subconsulta com os ids escolhidos por {'ids': [...]} ou {'filtro': {...}}.
+
+    O filtro usa os mesmos parâmetros de /acervo; um filtro vazio é recusado
+    para que um pedido malformado não alcance o acervo inteiro.
+    """
+    if not isinstance(dados, dict):
+        raise ValueError("o corpo deve ser um objeto JSON")
+    if dados.get('ids') is not None:
+        if not isinstance(dados['ids'], list):
+            raise ValueError("'ids' deve ser uma lista")
+        ids = {ler_inteiro(i) for i in dados['ids']}
+        if None in ids:
+            raise ValueError("'ids' deve conter apenas números")
+        return select(Ficha.id).where(Ficha.id.in_(sorted(ids)))
+
+    filtro = dados.get('filtro')
+    if not isinstance(filtro, dict):
+        raise ValueError("informe 'ids' ou 'filtro'")
+    desconhecidas = sorted(set(filtro) - set(CHAVES_FILTRO) - set(CHAVES_CONDICAO))
+    if desconhecidas:
+        raise ValueError(f"filtro desconhecido: {', '.join(desconhecidas)}")
+    args = MultiDict([(chave, str(valor).strip()) for chave, valores in filtro.items()
+                      for valor in (valores if isinstance(valores, list) else [valores])
+                      if valor is not None and str(valor).strip()])
+    filtros = ler_filtros(args)
+    # aplicar_filtros ignora valores que não entende (avaliação 9, data
+    # inválida); aqui eles são recusados em vez de alargar a seleção
+    for chave in CHAVES_FILTRO:
+        if chave in args and not filtros[chave]:
+            raise ValueError(f"valor inválido para '{chave}'")
+    if filtros['avaliacao'] is not None and filtros['avaliacao'] not in (1, 2, 3):
+        raise ValueError("'avaliacao' deve ser 1, 2 ou 3")
+    query = aplicar_filtros(db.session.query(Ficha.id), filtros)
+    if query.whereclause is None:
+        raise ValueError("filtro vazio")
+    return query.statement
+
+
+def _lotes(lista):
+    for inicio in range(0, len(lista), TAMANHO_LOTE_OPERACOES):
+        yield lista[inicio:inicio + TAMANHO_LOTE_OPERACOES]
+
+
+def _reservar_e_travar(selecao, *colunas):
+    """(último número reservado da sequência, linhas travadas) das fichas selecionadas.
+
+    O contador da sequência é travado antes das fichas, na mesma ordem de
+    salvar_ficha e da importação; na ordem inversa as duas gravações
+    podem se bloquear mutuamente. Como a quantidade é contada antes da
+    trava, reserva-se um número por ficha vista e só essas fichas são
+    travadas: as que sumirem nesse meio tempo deixam números sem uso.
+    """
+    ids = db.session.execute(select(Ficha.id).where(Ficha.id.in_(selecao)).order_by(Ficha.id)).scalars().all()
+    if not ids:
+        return 0, []
+    ultimo = reservar_sequencia(db.session.connection(), len(ids))
+    # FOR UPDATE: uma gravação simultânea nessas fichas espera o fim da
+    # operação, então as estatísticas descontadas são as que estão no banco
+    linhas = []
+    for lote in _lotes(ids):
+        linhas += db.session.execute(
+            select(Ficha.id, *colunas).where(Ficha.id.in_(lote)).order_by(Ficha.id).with_for_update()
+        ).all()
+    return ultimo, linhas
+
+
+def _invalidar_paginas(ids):
+    if len(ids) > INVALIDAR_TUDO_ACIMA:
+        paginas.invalidar('ficha:')
+        return
+    for id in ids:
+        invalidar_ficha(id)
+
+
+def excluir_fichas(selecao):
+    colunas = [getattr(Ficha, coluna) for coluna in COLUNAS_ESTATISTICA]
+    try:
+        ultimo, linhas = _reservar_e_travar(selecao, Ficha.numero_ficha, *colunas)
+        ids = [linha.id for linha in linhas]
+        contador = Counter()
+        for linha in linhas:
+            contador.subtract(contribuicoes(linha))
+
+        imagens = []
+        imagens_excluidas = 0
+        # os números mais altos da faixa reservada, na ordem do id
+        proximo = ultimo - len(linhas) + 1
+        for lote in _lotes(linhas):
+            db.session.execute(insert_dialeto(FichaRemovida).values([
+                {'seq': seq, 'ficha_id': linha.id, 'numero_ficha': linha.numero_ficha}
+                for seq, linha in enumerate(lote, start=proximo)
+            ]))
+            proximo += len(lote)
+            ids_lote = [linha.id for linha in lote]
+            imagens += db.session.execute(
+                select(Imagem.caminho, Imagem.hash).where(Imagem.ficha_id.in_(ids_lote))).all()
+            imagens_excluidas += db.session.execute(
+                delete(Imagem).where(Imagem.ficha_id.in_(ids_lote))).rowcount
+            db.session.execute(delete(Ficha).where(Ficha.id.in_(ids_lote)))
+        ajustar(contador)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # arquivos só são apagados depois do commit, fora da requisição
+    agendar_remocao(imagens)
+    _invalidar_paginas(ids)
+    return {'excluidas': len(ids), 'imagens_excluidas': imagens_excluidas,
+            'arquivos_verificados': len({img.caminho for img in imagens})}
+
+
+def _ler_valores(dados):
+    if not isinstance(dados, dict):
+        raise ValueError("'valores' deve ser um objeto")
+    valores = {}
+    for campo in CAMPOS_REATRIBUIVEIS:
+        if campo not in dados:
+            continue
+        if dados[campo] is not None and not isinstance(dados[campo], str):
+            raise ValueError(f"'{campo}' deve ser texto")
+        valor = (dados[campo] or '').strip() or None
+        limite = Ficha.__table__.c[campo].type.length
+        if valor and len(valor) > limite:
+            raise ValueError(f"'{campo}' aceita no máximo {limite} caracteres")
+        valores[campo] = valor
+    if not valores:
+        raise ValueError(f"informe ao menos um de: {', '.join(CAMPOS_REATRIBUIVEIS)}")
+    return valores
+
+
+def reatribuir_fichas(selecao, dados):
+    """Grava secao_guarda e/ou tecnico_nome em todas as fichas selecionadas."""
+    valores = _ler_valores(dados)
+    campos = list(valores)
+    try:
+        ultimo, linhas = _reservar_e_travar(selecao, *[getattr(Ficha, campo) for campo in campos])
+        # fichas que já têm esses valores não mudam de versão nem de sequência
+        alterar = [linha for linha in linhas if any(getattr(linha, c) != v for c, v in valores.items())]
+
+        contador = Counter()
+        if 'secao_guarda' in valores:
+            for linha in alterar:
+                contador[('secao_guarda', (linha.secao_guarda or '').strip())] -= 1
+                contador[('secao_guarda', valores['secao_guarda'] or '')] += 1
+
+        # cada ficha alterada recebe o seu número da faixa reservada (ordem
+        # do id), numa única instrução UPDATE ... FROM por lote
+        base = ultimo - len(alterar)
+        for lote in _lotes([linha.id for linha in alterar]):
+            ordem = (select(Ficha.id, func.row_number().over(order_by=Ficha.id).label('ordem'))
+                     .where(Ficha.id.in_(lote)).subquery())
+            db.session.execute(
+                update(Ficha).where(Ficha.id == ordem.c.id)
+                .values(**valores, versao=Ficha.versao + 1, seq_alteracao=base + ordem.c.ordem)
+                .execution_options(synchronize_session=False))
+            base += len(lote)
+        ajustar(contador)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    ids = [linha.id for linha in alterar]
+    _invalidar_paginas(ids)
+    return {'selecionadas': len(linhas), 'atualizadas': len(ids)}
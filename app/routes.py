@@ -1,184 +1,218 @@
-import os
-import uuid
 import io
-import pandas as pd
-from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, send_file
-from werkzeug.utils import secure_filename
-from app import app, db
-from .models import Ficha, Imagem
-
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-UPLOAD_FOLDER = os.path.join('app', 'static', 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def converter_booleano(valor):
-    if pd.isna(valor) or valor == '': return False
-    if isinstance(valor, bool): return valor
-    val_str = str(valor).lower().strip()
-    try:
-        numero = float(val_str.replace(',', '.'))
-        return numero > 0
-    except ValueError: pass
-    return val_str in ['sim', 's', 'true', 'x', 'yes', 'checked', 'on', 'verdadeiro']
-
-def converter_avaliacao(valor):
-    if pd.isna(valor): return 2
-    val_str = str(valor).lower().strip()
-    if val_str in ['1', 'bom']: return 1
-    if val_str in ['3', 'mau', 'ruim']: return 3
-    return 2
-
-def processar_grupo_checkbox(prefixo, lista_opcoes, form_data):
-    resultado = {}
-    for opcao in lista_opcoes:
-        chave_html = f"{prefixo}_{opcao}"
-        resultado[opcao] = True if form_data.get(chave_html) else False
-    
-    campo_outro = form_data.get(f"{prefixo}_outro")
-    if campo_outro:
-        resultado['outro_texto'] = campo_outro
-    return resultado
-
-def salvar_imagens(lista_arquivos, ficha_obj):
-    count = 0
-    for arquivo in lista_arquivos:
-        if arquivo and allowed_file(arquivo.filename):
-            filename = secure_filename(arquivo.filename)
-            novo_nome = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}_{filename}"
-            
-            caminho_relativo = f"uploads/{novo_nome}"
-            caminho_absoluto = os.path.join(UPLOAD_FOLDER, novo_nome)
-            
-            try:
-                arquivo.save(caminho_absoluto)
-                nova_img = Imagem(caminho=caminho_relativo, ficha=ficha_obj)
-                db.session.add(nova_img)
-                count += 1
-            except Exception as e:
-                print(f"Erro ao salvar imagem {filename}: {e}")
-    return count
-
-@app.route('/')
+import os
+from werkzeug.datastructures import MultiDict
+from flask import current_app, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, send_file, abort, make_response
+from .models import db, Ficha, Imagem, Tarefa, carregar_imagens
+from .consultas import listar_pagina, linha_para_dict, ler_filtros, ler_inteiro
+from .busca import buscar
+from .exportacao import FORMATOS, gerar_exportacao, iterar_linhas
+from . import estatisticas, operacoes_lote, sincronizacao, tarefas
+from .cache import paginas, chave_ficha, invalidar_ficha
+from . import instrumentacao
+from .imagens import RENDICOES, agendar_processamento, gerar_rendicao
+from .cadastro import ConflitoVersao, salvar_ficha
+
+# (regra, função, opções) de cada rota; registrar() as instala no app criado
+# por criar_app(), com o nome da função como endpoint
+ROTAS = []
+
+
+def rota(regra, **opcoes):
+    def decorador(funcao):
+        ROTAS.append((regra, funcao, opcoes))
+        return funcao
+    return decorador
+
+
+def registrar(app):
+    for regra, funcao, opcoes in ROTAS:
+        app.add_url_rule(regra, view_func=funcao, **opcoes)
+
+
+@rota('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', estatisticas=estatisticas.carregar(),
+                           rotulos=estatisticas.ROTULOS)
 
-@app.route('/acervo')
-def listar_acervo():
-    fichas = Ficha.query.order_by(Ficha.id.desc()).all()
-    return render_template('lista.html', fichas=fichas)
+@rota('/api/estatisticas')
+def estatisticas_json():
+    return jsonify(estatisticas.carregar())
 
-@app.route('/nova')
+@rota('/acervo')
+def listar_acervo():
+    fichas, proximo_cursor, filtros = listar_pagina(request.args)
+
+    args = request.args.to_dict(flat=False)
+    url_primeira = None
+    if args.pop('depois', None):
+        url_primeira = url_for('listar_acervo', **args)
+
+    url_proxima = None
+    if proximo_cursor:
+        url_proxima = url_for('listar_acervo', depois=proximo_cursor, **args)
+
+    return render_template('lista.html', fichas=fichas, filtros=filtros,
+                           url_primeira=url_primeira, url_proxima=url_proxima)
+
+@rota('/api/acervo')
+def listar_acervo_json():
+    fichas, proximo_cursor, _ = listar_pagina(request.args)
+    return jsonify({
+        'fichas': [linha_para_dict(f) for f in fichas],
+        'proximo_cursor': proximo_cursor
+    })
+
+@rota('/buscar')
+def buscar_fichas():
+    termo = request.args.get('q', '')
+    pagina = ler_inteiro(request.args.get('pagina'), 1)
+    fichas, tem_proxima = buscar(termo, pagina)
+
+    url_primeira = url_for('buscar_fichas', q=termo) if pagina > 1 else None
+    url_proxima = url_for('buscar_fichas', q=termo, pagina=pagina + 1) if tem_proxima else None
+    return render_template('lista.html', fichas=fichas, filtros=ler_filtros(MultiDict()), termo=termo,
+                           url_primeira=url_primeira, url_proxima=url_proxima)
+
+@rota('/api/buscar')
+def buscar_fichas_json():
+    pagina = ler_inteiro(request.args.get('pagina'), 1)
+    por_pagina = ler_inteiro(request.args.get('por_pagina'), 50)
+    fichas, tem_proxima = buscar(request.args.get('q', ''), pagina, por_pagina)
+    return jsonify({
+        'fichas': [linha_para_dict(f) for f in fichas],
+        'pagina': pagina,
+        'proxima_pagina': pagina + 1 if tem_proxima else None
+    })
+
+@rota('/nova')
 def nova_ficha():
     return render_template('fichas.html', ficha=None)
 
-@app.route('/ficha/<int:id>')
+@rota('/ficha/<int:id>')
 def ver_ficha(id):
-    ficha = Ficha.query.get_or_404(id)
-    return render_template('fichas.html', ficha=ficha)
+    # consulta só do carimbo de versão; a ficha completa (JSONB + imagens)
+    # só é carregada quando a página não está no cache
+    carimbo = db.session.query(Ficha.versao, Ficha.atualizado_em).filter_by(id=id).first()
+    if carimbo is None:
+        abort(404)
+    versao, atualizado_em = carimbo
+    etag = f"{id}-{versao}"
+
+    if request.if_none_match.contains(etag):
+        resposta = make_response('', 304)
+    else:
+        chave = chave_ficha(id, versao)
+        html = paginas.obter(chave)
+        if html is None:
+            ficha = Ficha.query.options(carregar_imagens('ficha')).get_or_404(id)
+            html = render_template('fichas.html', ficha=ficha).encode('utf-8')
+            paginas.guardar(chave, html)
+        resposta = make_response(html)
+
+    resposta.set_etag(etag)
+    if atualizado_em:
+        resposta.last_modified = atualizado_em
+    resposta.cache_control.no_cache = True
+    return resposta.make_conditional(request)
+
+@rota('/api/cache')
+def metricas_cache():
+    return jsonify(paginas.metricas())
+
+@rota('/metrics')
+def metricas_prometheus():
+    cache = paginas.metricas()
+    extras = {f'cache_paginas_{chave}': valor for chave, valor in cache.items() if isinstance(valor, int)}
+    return Response(instrumentacao.exportar_prometheus(extras), mimetype='text/plain; version=0.0.4')
+
+@rota('/api/metricas')
+def metricas_json():
+    return jsonify(instrumentacao.registro.resumo())
+
+@rota('/imagens/<int:id>/<rendicao>')
+def ver_rendicao(id, rendicao):
+    if rendicao not in RENDICOES:
+        abort(404)
+    imagem = Imagem.query.get_or_404(id)
+    try:
+        caminho = gerar_rendicao(imagem, rendicao)
+    except Exception as e:
+        print(f"Erro ao gerar {rendicao} de {imagem.caminho}: {e}")
+        caminho = None
+    if not caminho:
+        return redirect(url_for('static', filename=imagem.caminho))
+    return send_file(os.path.abspath(caminho), mimetype='image/jpeg', max_age=30 * 24 * 3600)
 
-@app.route('/criar', methods=['POST'])
+@rota('/criar', methods=['POST'])
 def criar_ficha():
+    resposta_json = request.args.get('formato') == 'json'
     try:
-        num_ficha = request.form.get('numero_ficha')
-        
-        ficha = Ficha.query.filter_by(numero_ficha=num_ficha).first()
-        if not ficha:
-            ficha = Ficha(numero_ficha=num_ficha)
-            db.session.add(ficha)
-        
-        ficha.avaliacao = request.form.get('avaliacao')
-        ficha.autor = request.form.get('autor')
-        ficha.titulo = request.form.get('titulo')
-        ficha.registro = request.form.get('registro')
-        ficha.n_chamada = request.form.get('n_chamada')
-        ficha.secao_guarda = request.form.get('secao_guarda')
-        ficha.data_obra = request.form.get('data_obra')
-        ficha.paginas = request.form.get('paginas')
-        ficha.dimensoes = request.form.get('dimensoes')
-        ficha.observacoes = request.form.get('observacoes')
-        ficha.tecnico_nome = request.form.get('tecnico_nome')
-
-        data_str = request.form.get('data_preenchimento')
-        if data_str:
-            ficha.data_preenchimento = datetime.strptime(data_str, '%Y-%m-%d').date()
+        ficha_id, versao, novas_imagens = salvar_ficha(request.form, request.files.getlist('fotos'))
+    except ConflitoVersao as conflito:
+        if resposta_json:
+            return jsonify({'erro': 'conflito', 'id': conflito.ficha_id,
+                            'versao_atual': conflito.versao_atual,
+                            'versao_enviada': conflito.versao_esperada}), 409
+        if conflito.ficha_id is None:
+            return "A ficha foi excluída enquanto era editada.", 409
+        if conflito.versao_esperada is None:
+            mensagem = "Já existe uma ficha com esse número. Os dados abaixo são os da ficha existente."
         else:
-            ficha.data_preenchimento = datetime.now().date()
-
-        ficha.especificacao_material = processar_grupo_checkbox('material', 
-            ['album', 'folheto', 'manuscrito', 'planta', 'brochura', 'gravura', 
-             'mapa', 'pergaminho', 'certificado', 'impresso', 'partitura', 'desenho', 'livro', 'periodico'], 
-            request.form)
-
-        ficha.tipo_suporte = processar_grupo_checkbox('suporte', 
-            ['couche', 'jornal', 'feito_mao', 'madeira'], 
-            request.form)
-
-        ficha.estado_conservacao = processar_grupo_checkbox('estado', 
-            ['encadernada', 'sem_encadernacao', 'inteira', 'meia_com_cantos', 'meia_sem_cantos'], 
-            request.form)
-
-        ficha.deterioracoes = processar_grupo_checkbox('det', 
-            ['abrasao', 'costura_fragil', 'mancha', 'rompimento', 'arranhao', 
-             'descoloracao', 'perda_lombada', 'sujidades'], 
-            request.form)
-
-        ficha.tratamento_planos = processar_grupo_checkbox('trat_plano', 
-            ['diagnostico', 'retirada_sujidades', 'trincha', 'higienizacao', 'retirada_fitas', 
-             'po_borracha', 'desacidificacao', 'arrefecimento', 'reestruturacao', 'remendos', 
-             'enxertos', 'velaturas', 'planificacao', 'acondicionamento', 'portfolio', 
-             'passe_partout', 'pasta', 'envelope', 'jaqueta'], 
-            request.form)
-
-        ficha.tratamento_volumes = processar_grupo_checkbox('trat_vol', 
-            ['fumigacao', 'fungos', 'insetos', 'higienizacao', 'trincha', 'reestruturacao', 
-             'lombada', 'lombada_capa', 'folhas', 'encadernacao', 'inteira', 'meia_sem_cantos', 
-             'costura', 'douracao', 'punho', 'maquina', 'acondicionamento', 'caixa_cruz', 'caixa_cadarco'], 
-            request.form)
-
-        db.session.commit()
-
-        fotos = request.files.getlist('fotos')
-        salvar_imagens(fotos, ficha)
-        db.session.commit()
-        
-        return redirect(url_for('ver_ficha', id=ficha.id))
-
+            mensagem = ("Esta ficha foi alterada por outra pessoa depois que você a abriu. "
+                        "Os dados abaixo são os atuais; refaça suas alterações e salve novamente.")
+        ficha = Ficha.query.options(carregar_imagens('ficha')).get(conflito.ficha_id)
+        return render_template('fichas.html', ficha=ficha, conflito=mensagem), 409
+    except ValueError as e:
+        if resposta_json:
+            return jsonify({'erro': str(e)}), 400
+        return str(e), 400
     except Exception as e:
-        db.session.rollback()
         print(f"Erro ao salvar: {e}")
         return f"Erro ao salvar: {e}", 500
 
-@app.route('/deletar/<int:id>', methods=['POST'])
+    agendar_processamento(novas_imagens)
+    invalidar_ficha(ficha_id)
+    if resposta_json:
+        return jsonify({'id': ficha_id, 'versao': versao})
+    return redirect(url_for('ver_ficha', id=ficha_id))
+
+@rota('/deletar/<int:id>', methods=['POST'])
 def deletar_ficha(id):
-    ficha = Ficha.query.get_or_404(id)
-    
     try:
-        # Passo 1: Apagar os arquivos físicos de imagem da pasta uploads
-        for imagem in ficha.imagens:
-            # Constrói o caminho completo do arquivo
-            caminho_absoluto = os.path.join('app', 'static', imagem.caminho)
-            if os.path.exists(caminho_absoluto):
-                os.remove(caminho_absoluto)
-        
-        # Passo 2: Deletar a ficha do banco de dados
-        # O SQLAlchemy se encarrega de deletar as linhas da tabela 'imagens' 
-        # automaticamente por causa do cascade='all, delete-orphan' no models.py
-        db.session.delete(ficha)
-        db.session.commit()
-        
-        flash('Ficha e imagens excluídas com sucesso!', 'success')
+        # as linhas de 'imagens' saem na mesma transação; os arquivos são
+        # apagados depois do commit, fora da requisição
+        resultado = operacoes_lote.excluir_fichas(operacoes_lote.selecionar({'ids': [id]}))
     except Exception as e:
-        db.session.rollback()
         print(f"Erro ao excluir ficha: {e}")
         flash(f'Erro ao excluir a ficha: {str(e)}', 'danger')
-        
-    return redirect(url_for('listar_acervo'))    
+        return redirect(url_for('listar_acervo'))
 
-@app.route('/importar', methods=['POST'])
+    if not resultado['excluidas']:
+        abort(404)
+    flash('Ficha e imagens excluídas com sucesso!', 'success')
+    return redirect(url_for('listar_acervo'))
+
+@rota('/api/fichas/excluir', methods=['POST'])
+def excluir_fichas_lote():
+    # {"ids": [1, 2, ...]} ou {"filtro": {"secao_guarda": "...", "deterioracoes": ["fungos"]}}
+    dados = request.get_json(silent=True) or {}
+    try:
+        selecao = operacoes_lote.selecionar(dados)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    return jsonify(operacoes_lote.excluir_fichas(selecao))
+
+@rota('/api/fichas/reatribuir', methods=['POST'])
+def reatribuir_fichas_lote():
+    # seleção como em /api/fichas/excluir, mais {"valores": {"secao_guarda": ..., "tecnico_nome": ...}}
+    dados = request.get_json(silent=True) or {}
+    try:
+        selecao = operacoes_lote.selecionar(dados)
+        return jsonify(operacoes_lote.reatribuir_fichas(selecao, dados.get('valores')))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+@rota('/importar', methods=['POST'])
 def importar_planilha():
     if 'arquivo_excel' not in request.files:
         flash('Nenhum arquivo enviado.', 'error')
@@ -190,142 +224,23 @@ def importar_planilha():
         return redirect(url_for('listar_acervo'))
 
     try:
-        if arquivo.filename.endswith('.csv'):
-            df = pd.read_csv(arquivo, sep=None, engine='python')
+        # pandas só é carregado quando alguém importa uma planilha
+        from .importacao import importar_arquivo
+        relatorio = importar_arquivo(arquivo, arquivo.filename, current_app.config['IMPORTACAO_TAMANHO_LOTE'],
+                                     processos=current_app.config['IMPORTACAO_PROCESSOS'],
+                                     tamanho_bloco=current_app.config['IMPORTACAO_TAMANHO_BLOCO'])
+        for lote in relatorio['lotes']:
+            print(f"Importação lote {lote['lote']}: {lote['inseridas']} inseridas, "
+                  f"{lote['ignoradas']} ignoradas, {lote['falhas']} com falha")
+
+        if request.args.get('formato') == 'json':
+            return jsonify(relatorio)
+
+        mensagem = f"Sucesso! {relatorio['inseridas']} fichas importadas, {relatorio['ignoradas']} ignoradas."
+        if relatorio['falhas']:
+            flash(f"{mensagem} {relatorio['falhas']} linhas falharam.", 'warning')
         else:
-            df = pd.read_excel(arquivo)
-        
-        df.columns = df.columns.str.strip()
-
-        imported_count = 0
-        
-        for index, row in df.iterrows():
-            
-            val_id = row.get('id') if 'id' in df.columns else row.get('numero_ficha')
-            num_ficha = str(val_id).split('.')[0]
-            
-            if not num_ficha or num_ficha == 'nan' or Ficha.query.filter_by(numero_ficha=num_ficha).first():
-                continue 
-
-            val_data = row.get('data_final') if 'data_final' in df.columns else datetime.now().date()
-            try:
-                data_final = pd.to_datetime(val_data).date()
-            except:
-                data_final = datetime.now().date()
-
-            tipo_enc_raw = str(row.get('enc_tipo', '')).lower()
-            eh_encadernada = False
-            if any(x in tipo_enc_raw for x in ['encadernada', 'inteira', 'meia', 'holandesa', 'capa']):
-                eh_encadernada = True
-            
-            if converter_booleano(row.get('sem_encadernacao')):
-                eh_encadernada = False
-
-            nova_ficha = Ficha(
-                numero_ficha = num_ficha,
-                avaliacao    = converter_avaliacao(row.get('estado_geral')),
-                autor        = row.get('autor', ''),
-                titulo       = row.get('titulo', ''),
-                registro     = str(row.get('registro', '')).replace('.0', '').replace('nan', ''),
-                n_chamada    = str(row.get('num_chamada', '')).replace('.0', '').replace('nan', ''),
-                secao_guarda = row.get('secao_guarda', ''),
-                data_obra    = str(row.get('data_obra', '')).replace('nan', ''),
-                paginas      = str(row.get('num_paginas', '')).replace('.0', '').replace('nan', ''),
-                dimensoes    = str(row.get('dimensoes', '')).replace('nan', ''),
-                observacoes  = row.get('observacoes', ''),
-                tecnico_nome = row.get('tecnico', ''),
-                data_preenchimento = data_final,
-
-                especificacao_material={
-                    'album': converter_booleano(row.get('espec_album')),
-                    'folheto': converter_booleano(row.get('espec_folheto')),
-                    'manuscrito': converter_booleano(row.get('espec_manuscrito')),
-                    'planta': converter_booleano(row.get('espec_planta')),
-                    'brochura': converter_booleano(row.get('espec_brochura')),
-                    'gravura': converter_booleano(row.get('espec_gravura')),
-                    'mapa': converter_booleano(row.get('espec_mapa')),
-                    'pergaminho': converter_booleano(row.get('espec_pergaminho_scroll')),
-                    'certificado': converter_booleano(row.get('espec_certificado')),
-                    'impresso': converter_booleano(row.get('espec_impresso')),
-                    'partitura': converter_booleano(row.get('espec_partitura')),
-                    'desenho': converter_booleano(row.get('espec_desenho')),
-                    'livro': converter_booleano(row.get('espec_livro')),
-                    'periodico': converter_booleano(row.get('espec_periodico')),
-                    'outro_texto': ''
-                },
-                tipo_suporte={
-                    'couche': converter_booleano(row.get('sup_papel_couche')),
-                    'jornal': converter_booleano(row.get('sup_papel_jornal')),
-                    'feito_mao': converter_booleano(row.get('sup_papel_feito_a_mao')),
-                    'madeira': converter_booleano(row.get('sup_papel_madeira')),
-                    'trapo': converter_booleano(row.get('sup_papel_trapo')),
-                    'marmorizado': converter_booleano(row.get('sup_papel_marmorizado'))
-                },
-                estado_conservacao={
-                    'encadernada': eh_encadernada,
-                    'sem_encadernacao': converter_booleano(row.get('sem_encadernacao')),
-                    'inteira': 'inteira' in tipo_enc_raw,
-                    'meia_com_cantos': 'meia' in tipo_enc_raw and 'cantos' in tipo_enc_raw,
-                    'tapa_madeira': converter_booleano(row.get('tapa_madeira')),
-                    'tapa_papelao': converter_booleano(row.get('tapa_papelao')),
-                    'capa_couro': converter_booleano(row.get('capa_couro')),
-                    'capa_tecido': converter_booleano(row.get('capa_tecido'))
-                },
-                deterioracoes={
-                    'abrasao': converter_booleano(row.get('det_enc_abrasao')),
-                    'arranhao': converter_booleano(row.get('det_enc_arranhao')),
-                    'costura_fragil': converter_booleano(row.get('det_enc_costura_fragilizada')),
-                    'descoloracao': converter_booleano(row.get('det_enc_descoloracao')),
-                    'lombada_quebrada': converter_booleano(row.get('det_enc_lombada_quebrada')),
-                    'mancha': converter_booleano(row.get('det_enc_mancha')) or converter_booleano(row.get('det_miolo_mancha')),
-                    'rompimento': converter_booleano(row.get('det_enc_rompimento')),
-                    'sujidades': converter_booleano(row.get('det_enc_sujidades')) or converter_booleano(row.get('det_miolo_sujidade')),
-                    'fungos': converter_booleano(row.get('det_miolo_fungos')),
-                    'oxidacao': converter_booleano(row.get('det_miolo_oxidacao'))
-                },
-                tratamento_planos={
-                    'diagnostico': converter_booleano(row.get('trat_plano_diagnostico')),
-                    'higienizacao': converter_booleano(row.get('trat_plano_higienizacao')),
-                    'retirada_sujidades': converter_booleano(row.get('trat_plano_retirada_de_sujidades_extrinsecas')),
-                    'retirada_fitas': converter_booleano(row.get('trat_plano_retirada_de_fitas_adesivas')),
-                    'desacidificacao': converter_booleano(row.get('trat_plano_desacidificacao_a_seco')),
-                    'arrefecimento': converter_booleano(row.get('trat_plano_arrefecimento_de_manchas')),
-                    'reestruturacao': converter_booleano(row.get('trat_plano_reestruturacao')),
-                    'remendos': converter_booleano(row.get('trat_plano_remendos')),
-                    'enxertos': converter_booleano(row.get('trat_plano_enxertos')),
-                    'velaturas': converter_booleano(row.get('trat_plano_velaturas')),
-                    'planificacao': converter_booleano(row.get('trat_plano_planificacao')),
-                    'acondicionamento': converter_booleano(row.get('trat_plano_acondicionamento')),
-                    'portfolio': converter_booleano(row.get('trat_plano_portfolio')),
-                    'envelope': converter_booleano(row.get('trat_plano_envelope')),
-                    'passe_partout': converter_booleano(row.get('trat_plano_passe_partout')),
-                    'pasta': converter_booleano(row.get('trat_plano_pasta')),
-                    'jaqueta': converter_booleano(row.get('trat_plano_jaqueta_de_poliester'))
-                },
-                tratamento_volumes={
-                    'fumigacao': converter_booleano(row.get('trat_vol_fumigacao')),
-                    'higienizacao': converter_booleano(row.get('trat_vol_higienizacao')),
-                    'reestruturacao': converter_booleano(row.get('trat_vol_reestruturacao')),
-                    'lombada': converter_booleano(row.get('trat_vol_lombada')),
-                    'lombada_capa': converter_booleano(row.get('trat_vol_lombada_e_capa'))
-                }
-            )
-
-            db.session.add(nova_ficha)
-            
-            caminho_antigo = row.get('Imagem 1')
-            
-            if pd.isna(caminho_antigo):
-                caminho_antigo = row.get('foto_path')
-                
-            if caminho_antigo and str(caminho_antigo).strip() != '' and str(caminho_antigo).lower() != 'nan':
-                nova_img = Imagem(caminho=str(caminho_antigo).strip(), ficha=nova_ficha)
-                db.session.add(nova_img)
-
-            imported_count += 1
-        
-        db.session.commit()
-        flash(f'Sucesso! {imported_count} fichas importadas.', 'success')
+            flash(mensagem, 'success')
         return redirect(url_for('listar_acervo'))
 
     except Exception as e:
@@ -334,129 +249,123 @@ def importar_planilha():
         flash(f'Erro ao processar: {str(e)}', 'danger')
         return redirect(url_for('listar_acervo'))
 
-@app.route('/exportar')
+@rota('/importar/validar', methods=['POST'])
+def validar_planilha():
+    # confere a planilha sem gravar nada: ?formato=json devolve o resumo,
+    # senão o relatório completo (uma linha por problema) em CSV
+    arquivo = request.files.get('arquivo_excel')
+    if not arquivo or arquivo.filename == '':
+        flash('Nenhum arquivo selecionado.', 'error')
+        return redirect(url_for('listar_acervo'))
+
+    from .importacao import validar_arquivo
+    saida = io.StringIO()
+    try:
+        resumo = validar_arquivo(arquivo, arquivo.filename, saida,
+                                 processos=current_app.config['IMPORTACAO_PROCESSOS'],
+                                 tamanho_bloco=current_app.config['IMPORTACAO_TAMANHO_BLOCO'])
+    except Exception as e:
+        db.session.rollback()
+        print(f"ERRO VALIDACAO: {e}")
+        if request.args.get('formato') == 'json':
+            return jsonify({'erro': str(e)}), 400
+        flash(f'Erro ao ler a planilha: {str(e)}', 'danger')
+        return redirect(url_for('listar_acervo'))
+
+    if request.args.get('formato') == 'json':
+        return jsonify(resumo)
+    return Response('\ufeff' + saida.getvalue(), mimetype='text/csv; charset=utf-8',
+                    headers={'Content-Disposition': 'attachment; filename=validacao.csv',
+                             'X-Linhas-Com-Problema': str(resumo['linhas_com_problema'])})
+
+@rota('/exportar')
 def exportar_planilha():
+    formato = request.args.get('formato', 'xlsx').lower()
+    if formato not in FORMATOS:
+        formato = 'xlsx'
+    # ?desde=<seq> (ou ?since=): só as fichas criadas/alteradas depois dessa
+    # sequência; o cabeçalho X-Seq-Alteracao traz o valor a usar na próxima exportação
+    desde = ler_inteiro(request.args.get('desde', request.args.get('since')))
+
     try:
-        fichas = Ficha.query.all()
-        if not fichas:
+        if desde is None and not db.session.query(Ficha.id).first():
             flash('Não há fichas para exportar.', 'warning')
             return redirect(url_for('listar_acervo'))
 
-        lista_dados = []
-
-        def processar_multiplos(dados_json, mapa_nomes):
-            if not dados_json: return ""
-            itens_encontrados = []
-            for chave_db, nome_legivel in mapa_nomes.items():
-                if dados_json.get(chave_db):
-                    itens_encontrados.append(nome_legivel)
-            outro = dados_json.get('outro_texto')
-            if outro and str(outro).strip():
-                itens_encontrados.append(f"Outro: {outro}")
-            return ", ".join(itens_encontrados)
-
-        def traduzir_avaliacao(valor):
-            if valor == 1: return "Bom"
-            if valor == 3: return "Mau"
-            return "Regular"
-
-        mapa_material = {
-            'album': 'Álbum', 'folheto': 'Folheto', 'manuscrito': 'Manuscrito',
-            'planta': 'Planta', 'brochura': 'Brochura', 'gravura': 'Gravura',
-            'mapa': 'Mapa', 'pergaminho': 'Pergaminho', 'certificado': 'Certificado',
-            'impresso': 'Impresso', 'partitura': 'Partitura', 'desenho': 'Desenho',
-            'livro': 'Livro', 'periodico': 'Periódico'
-        }
-        mapa_suporte = {
-            'couche': 'Papel Couchê', 'jornal': 'Papel Jornal',
-            'feito_mao': 'Papel Feito à Mão', 'madeira': 'Papel Madeira',
-            'trapo': 'Papel de Trapo', 'marmorizado': 'Papel Marmorizado'
-        }
-        mapa_estado = {
-            'encadernada': 'Encadernada', 'sem_encadernacao': 'Sem Encadernação',
-            'inteira': 'Enc. Inteira', 'meia_com_cantos': '½ com cantos',
-            'meia_sem_cantos': '½ sem cantos', 'capa_couro': 'Capa Couro',
-            'capa_tecido': 'Capa Tecido', 'tapa_madeira': 'Tapa Madeira',
-            'tapa_papelao': 'Tapa Papelão'
-        }
-        mapa_deterioracoes = {
-            'abrasao': 'Abrasão', 'costura_fragil': 'Costura Fragilizada',
-            'mancha': 'Mancha', 'rompimento': 'Rompimento', 'arranhao': 'Arranhão',
-            'descoloracao': 'Descoloração', 'perda_lombada': 'Perda de Lombada',
-            'sujidades': 'Sujidades', 'fungos': 'Fungos', 'oxidacao': 'Oxidação', 'lombada_quebrada': 'Lombada Quebrada'
-        }
-        mapa_plano = {
-            'diagnostico': 'Diagnóstico', 'higienizacao': 'Higienização',
-            'retirada_sujidades': 'Retirada Sujidades', 'retirada_fitas': 'Retirada Fitas',
-            'desacidificacao': 'Desacidificação', 'arrefecimento': 'Arrefecimento',
-            'reestruturacao': 'Reestruturação', 'remendos': 'Remendos',
-            'enxertos': 'Enxertos', 'velaturas': 'Velaturas',
-            'planificacao': 'Planificação', 'acondicionamento': 'Acondicionamento',
-            'portfolio': 'Portfólio', 'passe_partout': 'Passe-partout',
-            'pasta': 'Pasta', 'envelope': 'Envelope', 'jaqueta': 'Jaqueta'
-        }
-        mapa_volume = {
-            'fumigacao': 'Fumigação', 'fungos': 'Trat. Fungos', 'insetos': 'Trat. Insetos',
-            'higienizacao': 'Higienização', 'trincha': 'Trincha',
-            'reestruturacao': 'Reestruturação', 'lombada': 'Lombada',
-            'lombada_capa': 'Lombada e Capa', 'folhas': 'Folhas',
-            'encadernacao': 'Encadernação', 'inteira': 'Inteira',
-            'meia_sem_cantos': '½ Sem cantos', 'costura': 'Costura',
-            'douracao': 'Douração', 'punho': 'A Punho', 'maquina': 'À Máquina',
-            'acondicionamento': 'Acondicionamento', 'caixa_cruz': 'Caixa Cruz',
-            'caixa_cadarco': 'Caixa Cadarço'
-        }
-
-        for f in fichas:
-            caminhos_imagens = "; ".join([img.caminho for img in f.imagens])
-
-            linha = {
-                'ID': f.numero_ficha,
-                'Avaliação': traduzir_avaliacao(f.avaliacao),
-                'Autor': f.autor,
-                'Título': f.titulo,
-                'Registro': f.registro,
-                'Nº Chamada': f.n_chamada,
-                'Seção': f.secao_guarda,
-                'Data Obra': f.data_obra,
-                'Páginas': f.paginas,
-                'Dimensões': f.dimensoes,
-                'Especificação do Material': processar_multiplos(f.especificacao_material, mapa_material),
-                'Tipo de Suporte': processar_multiplos(f.tipo_suporte, mapa_suporte),
-                'Estado de Conservação': processar_multiplos(f.estado_conservacao, mapa_estado),
-                'Deteriorações': processar_multiplos(f.deterioracoes, mapa_deterioracoes),
-                'Tratamento (Planos)': processar_multiplos(f.tratamento_planos, mapa_plano),
-                'Tratamento (Volumes)': processar_multiplos(f.tratamento_volumes, mapa_volume),
-                'Observações': f.observacoes,
-                'Técnico': f.tecnico_nome,
-                'Data Preenchimento': f.data_preenchimento,
-                'Foto': caminhos_imagens
-            }
-            lista_dados.append(linha)
-
-        df = pd.DataFrame(lista_dados)
-        
-        colunas_ordem = ['ID', 'Título', 'Autor', 'Avaliação', 'Especificação do Material', 
-                         'Tipo de Suporte', 'Estado de Conservação', 'Deteriorações', 
-                         'Tratamento (Planos)', 'Tratamento (Volumes)', 'Observações', 'Técnico', 'Foto']
-        cols_existentes = [c for c in colunas_ordem if c in df.columns]
-        cols_restantes = [c for c in df.columns if c not in cols_existentes]
-        df = df[cols_existentes + cols_restantes]
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Acervo Consolidado')
-            worksheet = writer.sheets['Acervo Consolidado']
-            for column_cells in worksheet.columns:
-                length = max(len(str(cell.value)) for cell in column_cells)
-                if length > 50: length = 50
-                worksheet.column_dimensions[column_cells[0].column_letter].width = length + 2
-        
-        output.seek(0)
-        return send_file(output, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                         as_attachment=True, download_name='Relatorio_Resumido.xlsx')
+        mimetype, nome_arquivo = FORMATOS[formato]
+        seq = sincronizacao.seq_atual()
+        gerador = gerar_exportacao(formato, iterar_linhas(desde=desde, ate=seq if desde is not None else None))
+        return Response(stream_with_context(gerador), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={nome_arquivo}',
+                                 'X-Seq-Alteracao': str(seq)})
 
     except Exception as e:
         print(f"Erro na exportação: {e}")
         flash(f'Erro ao gerar planilha: {str(e)}', 'danger')
-        return redirect(url_for('listar_acervo'))
\ No newline at end of file
+        return redirect(url_for('listar_acervo'))
+
+@rota('/api/sincronizar')
+def sincronizar():
+    # ?desde=<seq> (ou ?since=): alterações e exclusões posteriores à sequência,
+    # em ordem; o consumidor repete com desde=<seq devolvido> enquanto tem_mais
+    desde = ler_inteiro(request.args.get('desde', request.args.get('since')), 0)
+    limite = ler_inteiro(request.args.get('limite'), sincronizacao.LIMITE_PADRAO)
+    limite = max(1, min(limite, sincronizacao.LIMITE_MAXIMO))
+    return jsonify(sincronizacao.alteracoes_desde(desde, limite))
+
+@rota('/tarefas/importar', methods=['POST'])
+def importar_planilha_tarefa():
+    arquivo = request.files.get('arquivo_excel')
+    if not arquivo or arquivo.filename == '':
+        flash('Nenhum arquivo selecionado.', 'error')
+        return redirect(url_for('listar_acervo'))
+
+    # ?validar=1: só gera o relatório de problemas, sem importar
+    tarefa = tarefas.criar_importacao(arquivo, validar=request.args.get('validar') == '1')
+    if request.args.get('formato') == 'json':
+        return jsonify(tarefa.para_dict()), 202
+    return redirect(url_for('ver_tarefa', id=tarefa.id))
+
+@rota('/tarefas/exportar', methods=['GET', 'POST'])
+def exportar_planilha_tarefa():
+    tarefa = tarefas.criar_exportacao(request.args.get('formato', 'xlsx').lower(),
+                                      ler_inteiro(request.args.get('desde', request.args.get('since'))))
+    if request.args.get('resposta') == 'json':
+        return jsonify(tarefa.para_dict()), 202
+    return redirect(url_for('ver_tarefa', id=tarefa.id))
+
+@rota('/tarefas/uploads', methods=['POST'])
+def verificar_uploads_tarefa():
+    # ?acao=relatorio (padrão), quarentena ou excluir; ver app/armazenamento.py
+    try:
+        tarefa = tarefas.criar_verificacao_uploads(request.args.get('acao', 'relatorio'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    if request.args.get('resposta') == 'json':
+        return jsonify(tarefa.para_dict()), 202
+    return redirect(url_for('ver_tarefa', id=tarefa.id))
+
+@rota('/tarefas/<int:id>')
+def ver_tarefa(id):
+    tarefas.recuperar_interrompidas()
+    tarefa = Tarefa.query.get_or_404(id)
+    return render_template('tarefa.html', tarefa=tarefa)
+
+@rota('/api/tarefas/<int:id>')
+def tarefa_json(id):
+    # a página da tarefa consulta aqui: uma tarefa órfã vira erro em vez de
+    # ficar 'executando' para sempre
+    tarefas.recuperar_interrompidas()
+    return jsonify(Tarefa.query.get_or_404(id).para_dict())
+
+@rota('/tarefas/<int:id>/arquivo')
+def baixar_arquivo_tarefa(id):
+    tarefa = Tarefa.query.get_or_404(id)
+    if tarefa.status != 'concluida' or not tarefa.arquivo_saida or not os.path.exists(tarefa.arquivo_saida):
+        abort(404)
+    if tarefa.tipo == 'validacao':
+        return send_file(tarefa.arquivo_saida, mimetype='text/csv; charset=utf-8', as_attachment=True,
+                         download_name=f'validacao_{tarefa.id}.csv')
+    formato = tarefa.parametros.get('formato', 'xlsx')
+    mimetype, nome_arquivo = FORMATOS.get(formato, FORMATOS['xlsx'])
+    return send_file(tarefa.arquivo_saida, mimetype=mimetype, as_attachment=True, download_name=nome_arquivo)
@@ -0,0 +1,109 @@
+from sqlalchemy import func, select, update
+from .models import db, Ficha, FichaRemovida, Contador, SEQUENCIA_ALTERACOES, carregar_imagens, reservar_sequencia
+
+LIMITE_PADRAO = 500
+LIMITE_MAXIMO = 5000
+
+
+def numerar(valores):
+    # gravações em massa (importação): um único incremento do contador
+    # reserva a faixa inteira, em vez de um por linha
+    if not valores:
+        return
+    ultimo = reservar_sequencia(db.session.connection(), len(valores))
+    for posicao, linha in enumerate(valores, start=ultimo - len(valores) + 1):
+        linha['seq_alteracao'] = posicao
+
+
+def registrar_remocao(ficha):
+    seq = reservar_sequencia(db.session.connection())
+    db.session.add(FichaRemovida(seq=seq, ficha_id=ficha.id, numero_ficha=ficha.numero_ficha))
+
+
+def seq_atual():
+    return db.session.query(Contador.valor).filter(Contador.nome == SEQUENCIA_ALTERACOES).scalar() or 0
+
+
+def preencher_sequencia():
+    # fichas gravadas antes da coluna existir entram na sequência pela ordem do id
+    pendentes = db.session.query(func.count(Ficha.id)).filter(Ficha.seq_alteracao.is_(None)).scalar()
+    if not pendentes:
+        return 0
+    maior_id = db.session.query(func.max(Ficha.id)).scalar()
+    base = reservar_sequencia(db.session.connection(), maior_id) - maior_id
+    db.session.execute(update(Ficha).where(Ficha.seq_alteracao.is_(None))
+                       .values(seq_alteracao=base + Ficha.id)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+    return pendentes
+
+
+def ficha_para_dict(f):
+    return {
+        'id': f.id,
+        'seq': f.seq_alteracao,
+        'numero_ficha': f.numero_ficha,
+        'avaliacao': f.avaliacao,
+        'autor': f.autor,
+        'titulo': f.titulo,
+        'registro': f.registro,
+        'n_chamada': f.n_chamada,
+        'secao_guarda': f.secao_guarda,
+        'data_obra': f.data_obra,
+        'paginas': f.paginas,
+        'dimensoes': f.dimensoes,
+        'especificacao_material': f.marcacoes('especificacao_material'),
+        'tipo_suporte': f.marcacoes('tipo_suporte'),
+        'estado_conservacao': f.marcacoes('estado_conservacao'),
+        'deterioracoes': f.marcacoes('deterioracoes'),
+        'tratamento_planos': f.marcacoes('tratamento_planos'),
+        'tratamento_volumes': f.marcacoes('tratamento_volumes'),
+        'observacoes': f.observacoes,
+        'tecnico_nome': f.tecnico_nome,
+        'data_preenchimento': f.data_preenchimento.isoformat() if f.data_preenchimento else None,
+        'versao': f.versao,
+        'criado_em': f.criado_em.isoformat() if f.criado_em else None,
+        'atualizado_em': f.atualizado_em.isoformat() if f.atualizado_em else None,
+        'imagens': [img.caminho for img in f.imagens],
+    }
+
+
+def alteracoes_desde(desde, limite=LIMITE_PADRAO):
+    """Fichas alteradas e removidas com seq > desde, em ordem de seq.
+
+    Devolve no máximo 'limite' itens somando os dois tipos; 'seq' é o valor a
+    usar como 'desde' na próxima chamada.
+    """
+    # lido antes das fichas: tudo com seq <= atual já está confirmado e
+    # aparece nas duas consultas abaixo; o que passar disso fica para a
+    # próxima chamada, senão uma alteração confirmada entre as duas consultas
+    # poderia ser pulada
+    atual = seq_atual()
+    alteradas = db.session.execute(
+        select(Ficha).options(carregar_imagens('lote'))
+        .where(Ficha.seq_alteracao > desde, Ficha.seq_alteracao <= atual)
+        .order_by(Ficha.seq_alteracao)
+        .limit(limite + 1)
+    ).scalars().all()
+    removidas = db.session.execute(
+        select(FichaRemovida)
+        .where(FichaRemovida.seq > desde, FichaRemovida.seq <= atual)
+        .order_by(FichaRemovida.seq)
+        .limit(limite + 1)
+    ).scalars().all()
+
+    # junta as duas listas pela sequência e corta no limite
+    itens = sorted([(f.seq_alteracao, 'alterada', f) for f in alteradas] +
+                   [(r.seq, 'removida', r) for r in removidas], key=lambda item: item[0])
+    tem_mais = len(itens) > limite
+    itens = itens[:limite]
+
+    return {
+        'desde': desde,
+        'seq': itens[-1][0] if itens else max(desde, atual),
+        'tem_mais': tem_mais,
+        'alteradas': [ficha_para_dict(obj) for _, tipo, obj in itens if tipo == 'alterada'],
+        'removidas': [{'seq': obj.seq, 'id': obj.ficha_id, 'numero_ficha': obj.numero_ficha,
+                       'removida_em': obj.removida_em.isoformat() if obj.removida_em else None}
+                      for _, tipo, obj in itens if tipo == 'removida'],
+    }
@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_, select, update
+from flask import current_app
+from werkzeug.utils import secure_filename
+from .models import db, Tarefa
+from .exportacao import FORMATOS, gerar_exportacao, iterar_linhas
+from .sincronizacao import seq_atual
+from . import armazenamento
+
+# Modos de execução (TAREFAS_MODO):
+#   'thread' -> as tarefas rodam num pool de threads do próprio processo web
+#   'fila'   -> a requisição só grava a tarefa como pendente; um processo
+#               separado (flask executar-tarefas) consome a tabela 'tarefas'
+
+INTERVALO_PROGRESSO = 1000
+ERRO_INTERROMPIDA = 'Tarefa interrompida: o processo que a executava parou (reinício ou deploy).'
+
+_executor = None
+
+
+def _pasta():
+    pasta = current_app.config['TAREFAS_PASTA']
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=current_app.config['TAREFAS_WORKERS'],
+                                       thread_name_prefix='tarefa')
+    return _executor
+
+
+def _atualizar(tarefa_id, **valores):
+    # conexão própria: o progresso fica visível mesmo no meio da transação
+    # (ou do cursor de streaming) usado pela tarefa
+    with db.engine.begin() as conn:
+        conn.execute(update(Tarefa).where(Tarefa.id == tarefa_id).values(**valores))
+
+
+def _enfileirar(tarefa):
+    em_thread = current_app.config['TAREFAS_MODO'] == 'thread'
+    tarefa.status = 'executando' if em_thread else 'pendente'
+    if em_thread:
+        tarefa.iniciada_em = tarefa.batimento_em = datetime.now()
+    db.session.add(tarefa)
+    db.session.commit()
+    if em_thread:
+        _pool().submit(_executar_em_contexto, current_app._get_current_object(), tarefa.id)
+    return tarefa
+
+
+def criar_importacao(arquivo, validar=False):
+    # validar=True só confere a planilha; o relatório sai em arquivo_saida
+    nome = f"{uuid.uuid4().hex}_{secure_filename(arquivo.filename)}"
+    caminho = os.path.join(_pasta(), nome)
+    arquivo.save(caminho)
+    return _enfileirar(Tarefa(tipo='validacao' if validar else 'importacao', arquivo_entrada=caminho,
+                              parametros={'nome_arquivo': arquivo.filename}))
+
+
+def criar_exportacao(formato, desde=None):
+    parametros = {'formato': formato}
+    if desde is not None:
+        parametros.update(desde=desde, ate=seq_atual())
+    return _enfileirar(Tarefa(tipo='exportacao', parametros=parametros))
+
+
+def criar_verificacao_uploads(acao='relatorio'):
+    if acao not in armazenamento.ACOES:
+        raise ValueError(f"ação inválida: {acao}")
+    return _enfileirar(Tarefa(tipo='armazenamento', parametros={'acao': acao}))
+
+
+def _executar_importacao(tarefa):
+    from .importacao import importar_arquivo
+
+    tarefa_id = tarefa.id
+
+    def progresso(linhas, lote):
+        _atualizar(tarefa_id, linhas_processadas=linhas)
+
+    relatorio = importar_arquivo(tarefa.arquivo_entrada, tarefa.parametros['nome_arquivo'],
+                                 current_app.config['IMPORTACAO_TAMANHO_LOTE'], progresso,
+                                 processos=current_app.config['IMPORTACAO_PROCESSOS'],
+                                 tamanho_bloco=current_app.config['IMPORTACAO_TAMANHO_BLOCO'])
+    return {'resultado': relatorio, 'linhas_processadas': relatorio['total_linhas']}
+
+
+def _executar_validacao(tarefa):
+    from .importacao import validar_arquivo
+
+    tarefa_id = tarefa.id
+    caminho = os.path.join(_pasta(), f"validacao_{tarefa.id}.csv")
+
+    def progresso(linhas):
+        _atualizar(tarefa_id, linhas_processadas=linhas)
+
+    # utf-8-sig: o Excel reconhece a acentuação ao abrir o relatório
+    with open(caminho, 'w', newline='', encoding='utf-8-sig') as saida:
+        relatorio = validar_arquivo(tarefa.arquivo_entrada, tarefa.parametros['nome_arquivo'], saida,
+                                    processos=current_app.config['IMPORTACAO_PROCESSOS'],
+                                    tamanho_bloco=current_app.config['IMPORTACAO_TAMANHO_BLOCO'],
+                                    progresso=progresso)
+    return {'arquivo_saida': caminho, 'resultado': relatorio, 'linhas_processadas': relatorio['total_linhas']}
+
+
+def _executar_exportacao(tarefa):
+    formato = tarefa.parametros.get('formato', 'xlsx')
+    if formato not in FORMATOS:
+        formato = 'xlsx'
+    caminho = os.path.join(_pasta(), f"exportacao_{tarefa.id}.{formato}")
+    tarefa_id = tarefa.id
+    total = [0]
+
+    def linhas_com_progresso():
+        linhas = iterar_linhas(desde=tarefa.parametros.get('desde'), ate=tarefa.parametros.get('ate'))
+        for i, linha in enumerate(linhas, start=1):
+            total[0] = i
+            if i % INTERVALO_PROGRESSO == 0:
+                _atualizar(tarefa_id, linhas_processadas=i)
+            yield linha
+
+    with open(caminho, 'wb') as saida:
+        for bloco in gerar_exportacao(formato, linhas_com_progresso()):
+            saida.write(bloco)
+
+    return {'arquivo_saida': caminho, 'linhas_processadas': total[0],
+            'resultado': {'formato': formato, 'linhas': total[0], 'seq': tarefa.parametros.get('ate')}}
+
+
+def _executar_verificacao_uploads(tarefa):
+    relatorio = armazenamento.verificar(tarefa.parametros.get('acao', 'relatorio'),
+                                        current_app.config['UPLOADS_IDADE_MINIMA'],
+                                        current_app.config['UPLOADS_QUARENTENA_PASTA'])
+    return {'resultado': relatorio, 'linhas_processadas': relatorio['arquivos']}
+
+
+EXECUTORES = {
+    'importacao': _executar_importacao,
+    'validacao': _executar_validacao,
+    'exportacao': _executar_exportacao,
+    'armazenamento': _executar_verificacao_uploads,
+}
+
+
+def _remover_entrada(caminho):
+    if caminho and os.path.exists(caminho):
+        os.remove(caminho)
+
+
+def _bater(app, tarefa_id, parar):
+    with app.app_context():
+        while not parar.wait(app.config['TAREFAS_INTERVALO_BATIMENTO']):
+            try:
+                _atualizar(tarefa_id, batimento_em=datetime.now())
+            except Exception as e:
+                print(f"Erro no sinal de vida da tarefa {tarefa_id}: {e}")
+
+
+def recuperar_interrompidas():
+    """Marca como erro as tarefas 'executando' cujo processo parou de dar sinal de vida."""
+    limite = datetime.now() - timedelta(seconds=current_app.config['TAREFAS_LIMITE_SEM_BATIMENTO'])
+    with db.engine.begin() as conn:
+        interrompidas = conn.execute(
+            update(Tarefa)
+            .where(Tarefa.status == 'executando',
+                   or_(Tarefa.batimento_em < limite,
+                       Tarefa.batimento_em.is_(None) & (Tarefa.atualizada_em < limite)))
+            .values(status='erro', erro=ERRO_INTERROMPIDA)
+            .returning(Tarefa.id, Tarefa.arquivo_entrada)
+        ).all()
+    for _, arquivo in interrompidas:
+        _remover_entrada(arquivo)
+    return len(interrompidas)
+
+
+def executar(tarefa_id):
+    tarefa = db.session.get(Tarefa, tarefa_id)
+    entrada = tarefa.arquivo_entrada
+    parar = threading.Event()
+    threading.Thread(target=_bater, args=(current_app._get_current_object(), tarefa_id, parar),
+                     name=f'batimento-{tarefa_id}', daemon=True).start()
+    try:
+        valores = EXECUTORES[tarefa.tipo](tarefa)
+        db.session.rollback()
+        _atualizar(tarefa_id, status='concluida', **valores)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro na tarefa {tarefa_id}: {e}")
+        _atualizar(tarefa_id, status='erro', erro=str(e))
+    finally:
+        parar.set()
+        # a planilha enviada só serve a esta execução, com sucesso ou não
+        _remover_entrada(entrada)
+        db.session.remove()
+
+
+def _executar_em_contexto(app, tarefa_id):
+    with app.app_context():
+        executar(tarefa_id)
+
+
+def reservar_proxima():
+    # SKIP LOCKED permite vários processos consumindo a fila sem disputar a mesma tarefa
+    proxima = (select(Tarefa.id)
+               .where(Tarefa.status == 'pendente')
+               .order_by(Tarefa.id)
+               .limit(1)
+               .with_for_update(skip_locked=True)
+               .scalar_subquery())
+    with db.engine.begin() as conn:
+        agora = datetime.now()
+        return conn.execute(
+            update(Tarefa).where(Tarefa.id == proxima)
+            .values(status='executando', iniciada_em=agora, batimento_em=agora).returning(Tarefa.id)
+        ).scalar()
+
+
+def consumir_fila(intervalo=2.0, uma_vez=False):
+    while True:
+        recuperar_interrompidas()
+        tarefa_id = reservar_proxima()
+        if tarefa_id:
+            executar(tarefa_id)
+        elif uma_vez:
+            return
+        else:
+            time.sleep(intervalo)
@@ -0,0 +1,200 @@
+from sqlalchemy import Integer, false, type_coerce
+from sqlalchemy.types import TypeDecorator
+from .config import carregar_perfil
+
+# Vocabulário dos grupos de checkbox, usado pelo formulário (/criar), pela
+# importação das planilhas antigas, pela exportação e pelo modo 'bits'.
+#
+# grupo -> (prefixo no formulário, [(chave, rótulo, aparece no formulário, colunas da planilha)])
+#
+# A posição da chave na lista é o seu bit no modo 'bits': chaves novas entram
+# sempre no final; nunca reordene nem remova.
+VOCABULARIO = {
+    'especificacao_material': ('material', [
+        ('album', 'Álbum', True, ['espec_album']),
+        ('folheto', 'Folheto', True, ['espec_folheto']),
+        ('manuscrito', 'Manuscrito', True, ['espec_manuscrito']),
+        ('planta', 'Planta', True, ['espec_planta']),
+        ('brochura', 'Brochura', True, ['espec_brochura']),
+        ('gravura', 'Gravura', True, ['espec_gravura']),
+        ('mapa', 'Mapa', True, ['espec_mapa']),
+        ('pergaminho', 'Pergaminho', True, ['espec_pergaminho_scroll']),
+        ('certificado', 'Certificado', True, ['espec_certificado']),
+        ('impresso', 'Impresso', True, ['espec_impresso']),
+        ('partitura', 'Partitura', True, ['espec_partitura']),
+        ('desenho', 'Desenho', True, ['espec_desenho']),
+        ('livro', 'Livro', True, ['espec_livro']),
+        ('periodico', 'Periódico', True, ['espec_periodico']),
+    ]),
+    'tipo_suporte': ('suporte', [
+        ('couche', 'Papel Couchê', True, ['sup_papel_couche']),
+        ('jornal', 'Papel Jornal', True, ['sup_papel_jornal']),
+        ('feito_mao', 'Papel Feito à Mão', True, ['sup_papel_feito_a_mao']),
+        ('madeira', 'Papel Madeira', True, ['sup_papel_madeira']),
+        ('trapo', 'Papel de Trapo', False, ['sup_papel_trapo']),
+        ('marmorizado', 'Papel Marmorizado', False, ['sup_papel_marmorizado']),
+    ]),
+    'estado_conservacao': ('estado', [
+        # encadernada/inteira/meia_com_cantos vêm da coluna enc_tipo na importação
+        ('encadernada', 'Encadernada', True, []),
+        ('sem_encadernacao', 'Sem Encadernação', True, ['sem_encadernacao']),
+        ('inteira', 'Enc. Inteira', True, []),
+        ('meia_com_cantos', '½ com cantos', True, []),
+        ('meia_sem_cantos', '½ sem cantos', True, []),
+        ('capa_couro', 'Capa Couro', False, ['capa_couro']),
+        ('capa_tecido', 'Capa Tecido', False, ['capa_tecido']),
+        ('tapa_madeira', 'Tapa Madeira', False, ['tapa_madeira']),
+        ('tapa_papelao', 'Tapa Papelão', False, ['tapa_papelao']),
+    ]),
+    'deterioracoes': ('det', [
+        ('abrasao', 'Abrasão', True, ['det_enc_abrasao']),
+        ('costura_fragil', 'Costura Fragilizada', True, ['det_enc_costura_fragilizada']),
+        ('mancha', 'Mancha', True, ['det_enc_mancha', 'det_miolo_mancha']),
+        ('rompimento', 'Rompimento', True, ['det_enc_rompimento']),
+        ('arranhao', 'Arranhão', True, ['det_enc_arranhao']),
+        ('descoloracao', 'Descoloração', True, ['det_enc_descoloracao']),
+        ('perda_lombada', 'Perda de Lombada', True, []),
+        ('sujidades', 'Sujidades', True, ['det_enc_sujidades', 'det_miolo_sujidade']),
+        ('fungos', 'Fungos', False, ['det_miolo_fungos']),
+        ('oxidacao', 'Oxidação', False, ['det_miolo_oxidacao']),
+        ('lombada_quebrada', 'Lombada Quebrada', False, ['det_enc_lombada_quebrada']),
+    ]),
+    'tratamento_planos': ('trat_plano', [
+        ('diagnostico', 'Diagnóstico', True, ['trat_plano_diagnostico']),
+        ('higienizacao', 'Higienização', True, ['trat_plano_higienizacao']),
+        ('retirada_sujidades', 'Retirada Sujidades', True, ['trat_plano_retirada_de_sujidades_extrinsecas']),
+        ('retirada_fitas', 'Retirada Fitas', True, ['trat_plano_retirada_de_fitas_adesivas']),
+        ('desacidificacao', 'Desacidificação', True, ['trat_plano_desacidificacao_a_seco']),
+        ('arrefecimento', 'Arrefecimento', True, ['trat_plano_arrefecimento_de_manchas']),
+        ('reestruturacao', 'Reestruturação', True, ['trat_plano_reestruturacao']),
+        ('remendos', 'Remendos', True, ['trat_plano_remendos']),
+        ('enxertos', 'Enxertos', True, ['trat_plano_enxertos']),
+        ('velaturas', 'Velaturas', True, ['trat_plano_velaturas']),
+        ('planificacao', 'Planificação', True, ['trat_plano_planificacao']),
+        ('acondicionamento', 'Acondicionamento', True, ['trat_plano_acondicionamento']),
+        ('portfolio', 'Portfólio', True, ['trat_plano_portfolio']),
+        ('passe_partout', 'Passe-partout', True, ['trat_plano_passe_partout']),
+        ('pasta', 'Pasta', True, ['trat_plano_pasta']),
+        ('envelope', 'Envelope', True, ['trat_plano_envelope']),
+        ('jaqueta', 'Jaqueta', True, ['trat_plano_jaqueta_de_poliester']),
+        ('trincha', 'Trincha', True, []),
+        ('po_borracha', 'Pó de Borracha', True, []),
+    ]),
+    'tratamento_volumes': ('trat_vol', [
+        ('fumigacao', 'Fumigação', True, ['trat_vol_fumigacao']),
+        ('fungos', 'Trat. Fungos', True, []),
+        ('insetos', 'Trat. Insetos', True, []),
+        ('higienizacao', 'Higienização', True, ['trat_vol_higienizacao']),
+        ('trincha', 'Trincha', True, []),
+        ('reestruturacao', 'Reestruturação', True, ['trat_vol_reestruturacao']),
+        ('lombada', 'Lombada', True, ['trat_vol_lombada']),
+        ('lombada_capa', 'Lombada e Capa', True, ['trat_vol_lombada_e_capa']),
+        ('folhas', 'Folhas', True, []),
+        ('encadernacao', 'Encadernação', True, []),
+        ('inteira', 'Inteira', True, []),
+        ('meia_sem_cantos', '½ Sem cantos', True, []),
+        ('costura', 'Costura', True, []),
+        ('douracao', 'Douração', True, []),
+        ('punho', 'A Punho', True, []),
+        ('maquina', 'À Máquina', True, []),
+        ('acondicionamento', 'Acondicionamento', True, []),
+        ('caixa_cruz', 'Caixa Cruz', True, []),
+        ('caixa_cadarco', 'Caixa Cadarço', True, []),
+    ]),
+}
+
+GRUPOS = list(VOCABULARIO)
+
+# Armazenamento dos grupos na tabela fichas (MARCACOES_ARMAZENAMENTO):
+#   'jsonb' -> um dict {chave: bool} por grupo, com índice GIN (padrão)
+#   'bits'  -> um inteiro por grupo, bit i = i-ésima chave do vocabulário;
+#              os textos de "Outro" ficam em fichas.outros_textos
+# Trocar de modo exige converter o banco: flask migrar-marcacoes --para <modo>
+MODOS = ('jsonb', 'bits')
+MODO = carregar_perfil().MARCACOES_ARMAZENAMENTO
+if MODO not in MODOS:
+    raise ValueError(f"MARCACOES_ARMAZENAMENTO inválido: {MODO!r} (use {' ou '.join(MODOS)})")
+
+POSICOES = {grupo: {chave: i for i, (chave, *_) in enumerate(opcoes)}
+            for grupo, (_, opcoes) in VOCABULARIO.items()}
+for _grupo, _posicoes in POSICOES.items():
+    # a coluna é INTEGER (com sinal)
+    assert len(_posicoes) <= 31, f"vocabulário de {_grupo} não cabe em 31 bits"
+
+
+def chaves(grupo):
+    return list(POSICOES[grupo])
+
+
+def rotulos(grupo):
+    return {chave: rotulo for chave, rotulo, *_ in VOCABULARIO[grupo][1]}
+
+
+def opcoes_formulario():
+    return {grupo: (prefixo, [chave for chave, _, no_formulario, _ in opcoes if no_formulario])
+            for grupo, (prefixo, opcoes) in VOCABULARIO.items()}
+
+
+def mapa_importacao():
+    mapa = {}
+    for grupo, (_, opcoes) in VOCABULARIO.items():
+        colunas = {chave: planilha for chave, _, _, planilha in opcoes if planilha}
+        if colunas:
+            mapa[grupo] = colunas
+    return mapa
+
+
+def codificar(grupo, dados):
+    posicoes = POSICOES[grupo]
+    return sum(1 << posicoes[chave] for chave, marcado in dados.items()
+               if marcado is True and chave in posicoes)
+
+
+def decodificar(grupo, bits):
+    return {chave: bool(bits >> posicao & 1) for chave, posicao in POSICOES[grupo].items()}
+
+
+class Marcacoes(TypeDecorator):
+    """Grupo de checkbox gravado como inteiro; no Python continua sendo um dict."""
+
+    impl = Integer
+    cache_ok = True
+
+    def __init__(self, grupo):
+        super().__init__()
+        self.grupo = grupo
+
+    def process_bind_param(self, valor, dialect):
+        if valor is None or isinstance(valor, int):
+            return valor
+        return codificar(self.grupo, valor)
+
+    def process_result_value(self, valor, dialect):
+        return None if valor is None else decodificar(self.grupo, valor)
+
+
+def tipo_coluna(grupo, jsonb):
+    return Marcacoes(grupo) if MODO == 'bits' else jsonb
+
+
+def filtro_marcadas(coluna, grupo, chaves_marcadas):
+    """Condição SQL: todas as chaves marcadas no grupo."""
+    if MODO == 'jsonb':
+        return coluna.contains({chave: True for chave in chaves_marcadas})
+    if any(chave not in POSICOES[grupo] for chave in chaves_marcadas):
+        return false()
+    mascara = codificar(grupo, {chave: True for chave in chaves_marcadas})
+    return type_coerce(coluna, Integer).op('&')(mascara) == mascara
+
+
+def separar_outros(valores):
+    # no modo 'bits' o texto de "Outro" não cabe no inteiro do grupo
+    if MODO != 'bits':
+        return valores
+    outros = {}
+    for grupo in GRUPOS:
+        texto = (valores.get(grupo) or {}).get('outro_texto')
+        if texto:
+            outros[grupo] = texto
+    valores['outros_textos'] = outros or None
+    return valores
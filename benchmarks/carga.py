@@ -0,0 +1,72 @@
+"""Teste de carga simples para /acervo e /ficha/<id>.
+
+Dispara requisições concorrentes contra um servidor já em execução e
+mostra requisições por segundo e latências. Rode uma vez para cada perfil
+e compare:
+
+    APP_PERFIL=desenvolvimento flask run                  # terminal 1
+    python benchmarks/carga.py --perfil desenvolvimento    # terminal 2
+
+    APP_PERFIL=producao gunicorn -c gunicorn.conf.py 'app:criar_app()'
+    python benchmarks/carga.py --perfil producao
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def requisitar(url):
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as resposta:
+            resposta.read()
+            ok = resposta.status == 200
+    except Exception:
+        ok = False
+    return ok, (time.perf_counter() - inicio) * 1000
+
+
+def medir(url, total, concorrencia):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        resultados = list(pool.map(requisitar, [url] * total))
+    duracao = time.perf_counter() - inicio
+
+    latencias = sorted(ms for ok, ms in resultados if ok)
+    falhas = sum(1 for ok, _ in resultados if not ok)
+    return {
+        'url': url,
+        'requisicoes': total,
+        'falhas': falhas,
+        'req_por_segundo': round(len(latencias) / duracao, 1),
+        'latencia_mediana_ms': round(statistics.median(latencias), 1) if latencias else None,
+        'latencia_p95_ms': round(latencias[int(len(latencias) * 0.95) - 1], 1) if latencias else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--perfil', default='desconhecido', help='rótulo do perfil em teste')
+    parser.add_argument('--ficha', type=int, default=1, help='id usado em /ficha/<id>')
+    parser.add_argument('--requisicoes', type=int, default=500)
+    parser.add_argument('--concorrencia', type=int, default=20)
+    args = parser.parse_args()
+
+    resultados = []
+    for rota in ['/acervo', f'/ficha/{args.ficha}']:
+        resultado = medir(args.url + rota, args.requisicoes, args.concorrencia)
+        resultado['perfil'] = args.perfil
+        resultados.append(resultado)
+        print(f"[{args.perfil}] {rota:15} {resultado['req_por_segundo']:8} req/s  "
+              f"mediana {resultado['latencia_mediana_ms']} ms  p95 {resultado['latencia_p95_ms']} ms  "
+              f"falhas {resultado['falhas']}")
+
+    print(json.dumps(resultados, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Gerador determinístico de fichas sintéticas.
+
+As chaves dos grupos JSONB vêm do próprio app (OPCOES_FORMULARIO, usado em
+/criar, e MAPA_IMPORTACAO, usado em /importar), então o acervo gerado tem a
+mesma mistura que o banco real: fichas cadastradas pelo formulário e fichas
+vindas das planilhas antigas, cada uma com o seu vocabulário.
+
+Com a mesma semente o resultado é sempre o mesmo. Para gerar só a planilha:
+
+    python benchmarks/gerador.py --linhas 10000 --saida acervo.csv
+    python benchmarks/gerador.py --linhas 10000 --saida acervo.xlsx
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# perfil de produção: importar o app não cria nem altera tabelas
+os.environ.setdefault('APP_PERFIL', 'producao')
+
+from app.importacao import MAPA_IMPORTACAO  # noqa: E402
+from app.cadastro import OPCOES_FORMULARIO  # noqa: E402
+
+SEMENTE_PADRAO = 42
+# fração do acervo que veio das planilhas antigas
+FRACAO_PLANILHA = 0.7
+PROBABILIDADE_PADRAO = 0.08
+
+# probabilidade de cada chave estar marcada; as demais usam PROBABILIDADE_PADRAO
+PROBABILIDADES = {
+    'tipo_suporte': {'couche': 0.15, 'jornal': 0.10, 'trapo': 0.20, 'feito_mao': 0.05},
+    'deterioracoes': {
+        'sujidades': 0.55, 'mancha': 0.40, 'abrasao': 0.30, 'oxidacao': 0.25,
+        'rompimento': 0.15, 'costura_fragil': 0.15, 'descoloracao': 0.12, 'fungos': 0.03,
+    },
+    'tratamento_planos': {
+        'diagnostico': 0.90, 'higienizacao': 0.60, 'trincha': 0.50, 'retirada_sujidades': 0.35,
+        'acondicionamento': 0.30, 'remendos': 0.20, 'planificacao': 0.15, 'desacidificacao': 0.05,
+    },
+    'tratamento_volumes': {
+        'higienizacao': 0.60, 'trincha': 0.45, 'reestruturacao': 0.20, 'lombada': 0.10,
+        'acondicionamento': 0.25, 'fumigacao': 0.04, 'fungos': 0.03, 'insetos': 0.03,
+    },
+}
+
+# um material por ficha, com pesos
+PESOS_MATERIAL = {
+    'livro': 60, 'periodico': 15, 'folheto': 8, 'brochura': 5, 'manuscrito': 3, 'mapa': 2,
+    'partitura': 2, 'impresso': 2, 'album': 1, 'gravura': 1, 'desenho': 1, 'certificado': 1,
+    'planta': 1, 'pergaminho': 1,
+}
+PESOS_AVALIACAO = {1: 30, 2: 50, 3: 20}
+# tipo de encadernação na planilha (coluna enc_tipo) e o estado correspondente no formulário
+ENCADERNACOES = {
+    'inteira': ['encadernada', 'inteira'],
+    'meia com cantos': ['encadernada', 'meia_com_cantos'],
+    'meia sem cantos': ['encadernada', 'meia_sem_cantos'],
+    '': ['sem_encadernacao'],
+}
+PESOS_ENCADERNACAO = {'inteira': 30, 'meia com cantos': 20, 'meia sem cantos': 15, '': 35}
+
+SECOES = ['Obras Raras', 'Coleção Geral', 'Periódicos', 'Mapoteca', 'Arquivo Histórico',
+          'Iconografia', 'Música', 'Coleção Especial']
+TECNICOS = ['Ana Souza', 'Bruno Lima', 'Carla Mendes', 'Diego Rocha', 'Elisa Prado']
+NOMES = ['Machado', 'Alencar', 'Azevedo', 'Lispector', 'Queiroz', 'Andrade', 'Bandeira',
+         'Meireles', 'Ramos', 'Amado', 'Rosa', 'Veríssimo', 'Barreto', 'Lobato', 'Castro Alves']
+PRENOMES = ['José', 'Maria', 'João', 'Ana', 'Francisco', 'Antônio', 'Clarice', 'Graciliano',
+            'Cecília', 'Manuel', 'Rachel', 'Jorge', 'Lima', 'Érico', 'Monteiro']
+PALAVRAS = ['história', 'memórias', 'cartas', 'viagem', 'relatório', 'poesias', 'crônicas',
+            'sertão', 'província', 'império', 'república', 'anais', 'revista', 'almanaque',
+            'estudos', 'notícia', 'descrição', 'geografia', 'música', 'catálogo', 'coleção',
+            'diário', 'boletim', 'fazenda', 'capital', 'senado', 'câmara', 'igreja', 'colégio']
+OBSERVACOES = ['Folhas soltas no final do volume.', 'Carimbo de biblioteca particular.',
+               'Anotações a lápis nas margens.', 'Falta a folha de rosto.',
+               'Encadernação refeita anteriormente.', 'Manchas de umidade no corte inferior.']
+
+DATA_BASE = date(2019, 1, 1)
+
+
+def _escolher(rng, pesos):
+    return rng.choices(list(pesos), weights=list(pesos.values()))[0]
+
+
+def _grupo(rng, grupo, chaves):
+    probabilidades = PROBABILIDADES.get(grupo, {})
+    return {chave: rng.random() < probabilidades.get(chave, PROBABILIDADE_PADRAO) for chave in chaves}
+
+
+def _texto(rng, i):
+    titulo = ' '.join(rng.choice(PALAVRAS) for _ in range(rng.randint(2, 6))).capitalize()
+    return {
+        'titulo': titulo,
+        'autor': f"{rng.choice(NOMES).upper()}, {rng.choice(PRENOMES)}" if rng.random() < 0.9 else None,
+        'registro': str(100000 + i),
+        'n_chamada': f"{rng.randint(0, 999):03d}.{rng.randint(1, 9)} {rng.choice(NOMES)[0]}{rng.randint(100, 999)}",
+        'secao_guarda': rng.choice(SECOES),
+        'data_obra': str(rng.randint(1750, 1990)),
+        'paginas': str(rng.randint(8, 900)),
+        'dimensoes': f"{rng.randint(10, 40)} x {rng.randint(8, 30)} cm",
+        'observacoes': rng.choice(OBSERVACOES) if rng.random() < 0.25 else None,
+        'tecnico_nome': rng.choice(TECNICOS),
+        'data_preenchimento': DATA_BASE + timedelta(days=rng.randint(0, 5 * 365)),
+        'avaliacao': _escolher(rng, PESOS_AVALIACAO),
+    }
+
+
+def _gerador(semente, i):
+    # um gerador por ficha: a ficha i é a mesma qualquer que seja o tamanho do acervo
+    return random.Random(semente * 1000003 + i)
+
+
+def ficha(i, semente=SEMENTE_PADRAO):
+    """Colunas de uma ficha, no formato gravado no banco."""
+    rng = _gerador(semente, i)
+    dados = _texto(rng, i)
+    dados['numero_ficha'] = str(i)
+    material = _escolher(rng, PESOS_MATERIAL)
+    encadernacao = _escolher(rng, PESOS_ENCADERNACAO)
+
+    if rng.random() < FRACAO_PLANILHA:
+        dados['origem'] = 'planilha'
+        vocabulario = {grupo: list(chaves) for grupo, chaves in MAPA_IMPORTACAO.items()}
+    else:
+        dados['origem'] = 'formulario'
+        vocabulario = {grupo: opcoes for grupo, (_, opcoes) in OPCOES_FORMULARIO.items()}
+
+    for grupo, chaves in vocabulario.items():
+        dados[grupo] = _grupo(rng, grupo, chaves)
+    dados['especificacao_material'] = {chave: chave == material
+                                       for chave in vocabulario['especificacao_material']}
+    dados['especificacao_material']['outro_texto'] = ''
+
+    estado = {chave: False for chave in vocabulario['estado_conservacao']}
+    for chave in ENCADERNACOES[encadernacao]:
+        estado[chave] = True
+    dados['estado_conservacao'] = estado
+    dados['enc_tipo'] = encadernacao
+
+    dados['caminho_imagem'] = f"uploads/legado/{i}.jpg" if rng.random() < 0.6 else ''
+    return dados
+
+
+def fichas(quantidade, semente=SEMENTE_PADRAO, inicio=1):
+    for i in range(inicio, inicio + quantidade):
+        yield ficha(i, semente)
+
+
+def linha_planilha(i, semente=SEMENTE_PADRAO):
+    """Uma linha no layout das planilhas antigas aceitas por /importar."""
+    dados = ficha(i, semente)
+    linha = {
+        'id': dados['numero_ficha'],
+        'titulo': dados['titulo'],
+        'autor': dados['autor'],
+        'estado_geral': {1: 'bom', 2: 'regular', 3: 'ruim'}[dados['avaliacao']],
+        'registro': dados['registro'],
+        'num_chamada': dados['n_chamada'],
+        'secao_guarda': dados['secao_guarda'],
+        'data_obra': dados['data_obra'],
+        'num_paginas': dados['paginas'],
+        'dimensoes': dados['dimensoes'],
+        'observacoes': dados['observacoes'],
+        'tecnico': dados['tecnico_nome'],
+        'data_final': dados['data_preenchimento'].isoformat(),
+        'enc_tipo': dados['enc_tipo'],
+    }
+    for grupo, chaves in MAPA_IMPORTACAO.items():
+        for chave, colunas in chaves.items():
+            marcada = dados[grupo].get(chave, False)
+            for coluna in colunas:
+                linha[coluna] = 'x' if marcada and coluna == colunas[0] else ''
+    linha['foto_path'] = dados['caminho_imagem']
+    return linha
+
+
+def planilha(quantidade, semente=SEMENTE_PADRAO, inicio=1):
+    import pandas as pd
+
+    return pd.DataFrame([linha_planilha(i, semente) for i in range(inicio, inicio + quantidade)])
+
+
+def formulario(i, semente=SEMENTE_PADRAO):
+    """Campos do POST em /criar para a ficha i (sempre com o vocabulário do formulário)."""
+    rng = _gerador(semente, i)
+    dados = _texto(rng, i)
+    campos = {chave: valor for chave, valor in dados.items()
+              if chave not in ('data_preenchimento', 'avaliacao') and valor is not None}
+    campos['numero_ficha'] = str(i)
+    campos['avaliacao'] = str(dados['avaliacao'])
+    campos['data_preenchimento'] = dados['data_preenchimento'].isoformat()
+
+    material = _escolher(rng, PESOS_MATERIAL)
+    campos[f"material_{material}"] = 'on'
+    for chave in ENCADERNACOES[_escolher(rng, PESOS_ENCADERNACAO)]:
+        campos[f"estado_{chave}"] = 'on'
+    for grupo, (prefixo, opcoes) in OPCOES_FORMULARIO.items():
+        if grupo in ('especificacao_material', 'estado_conservacao'):
+            continue
+        for chave, marcada in _grupo(rng, grupo, opcoes).items():
+            if marcada:
+                campos[f"{prefixo}_{chave}"] = 'on'
+    return campos
+
+
+def popular(quantidade, semente=SEMENTE_PADRAO, inicio=1, tamanho_lote=5000):
+    """Grava as fichas direto no banco (deve rodar dentro de um app_context)."""
+    from app.models import db, Ficha, Imagem, insert_dialeto
+    from app.estatisticas import reconstruir
+    from app.sincronizacao import numerar
+    from app.vocabulario import separar_outros
+
+    colunas = {c.name for c in Ficha.__table__.columns}
+    lote = []
+
+    def gravar():
+        caminhos = {f['numero_ficha']: f['caminho_imagem'] for f in lote}
+        valores = [separar_outros({k: v for k, v in f.items() if k in colunas}) for f in lote]
+        numerar(valores)
+        inseridas = db.session.execute(
+            insert_dialeto(Ficha).values(valores).returning(Ficha.id, Ficha.numero_ficha)).all()
+        imagens = [{'ficha_id': id_ficha, 'caminho': caminhos[numero]}
+                   for id_ficha, numero in inseridas if caminhos[numero]]
+        if imagens:
+            db.session.execute(insert_dialeto(Imagem).values(imagens))
+        db.session.commit()
+        lote.clear()
+
+    for dados in fichas(quantidade, semente, inicio):
+        lote.append(dados)
+        if len(lote) >= tamanho_lote:
+            gravar()
+    if lote:
+        gravar()
+    reconstruir()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=1000)
+    parser.add_argument('--semente', type=int, default=SEMENTE_PADRAO)
+    parser.add_argument('--saida', default='acervo_sintetico.csv', help='.csv ou .xlsx')
+    args = parser.parse_args()
+
+    df = planilha(args.linhas, args.semente)
+    if args.saida.endswith('.xlsx'):
+        df.to_excel(args.saida, index=False)
+    else:
+        df.to_csv(args.saida, index=False)
+    print(f"{len(df)} linhas gravadas em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 6)))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# cada worker tem seu próprio pool: uma conexão por thread de requisição
+# (exportações em streaming a seguram até o fim da resposta) e o excedente
+# para as tarefas e imagens em segundo plano (config.conexoes_em_segundo_plano).
+# O Postgres precisa de max_connections acima de
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW); no padrão, 6 * (4 + 10) = 84
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+# recicla workers periodicamente para conter crescimento de memória; no
+# modo TAREFAS_MODO=thread as tarefas rodam dentro do worker e a reciclagem
+# as interromperia no meio, então fica desligada (use 'fila' para tê-la)
+if os.getenv('TAREFAS_MODO', 'thread') == 'thread':
+    max_requests = 0
+else:
+    max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+accesslog = '-'
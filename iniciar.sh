@@ -0,0 +1,10 @@
+#!/bin/sh
+set -e
+
+if [ "$APP_PERFIL" = "producao" ]; then
+    flask inicializar-banco --aguardar 60
+    exec gunicorn -c gunicorn.conf.py 'app:criar_app()'
+else
+    export FLASK_DEBUG=1
+    exec flask run --host=0.0.0.0
+fi